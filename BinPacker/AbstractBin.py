@@ -1,3 +1,6 @@
+from .Rectangle import Rectangle
+
+
 class Bin:
     def __init__(self):
         self.width = 0
@@ -7,23 +10,79 @@ class Bin:
         self.freeRects = []
         self.rects = []
         self.options = {'smart': True, 'pot': True, 'square': True,
-                        'allowRotation': False, 'tag': False, 'border': 0}
+                        'allowRotation': False, 'tag': False, 'border': 0,
+                        'heuristic': 'area'}
         self.data = None
         self.tag = None
+        # Optional callable(event, **info) used to collect statistics
+        self.hook = None
         self._dirty = 0
+        # Number of rects in this bin changed since the last setDirty(False)
+        self.dirtyRects = 0
 
-    def add(self, rect=None, width=None, height=None, data=None):
+    def accepts(self, rect):
+        return not self.options['tag'] or self.tag == rect.tag
+
+    def place(self, rect):
+        # Positions rect inside of the bin, returns False when it doesn't fit
+        return False
+
+    def freed(self, rect):
+        # Space of rect removed from the bin, which still holds other rects
         pass
 
+    def add(self, rect=None, width=None, height=None, data=None):
+        if rect:
+            if not self.accepts(rect):
+                return False
+        elif width and height:
+            if self.options['tag']:
+                if data and 'tag' in data and self.tag != data['tag']:
+                    return False
+                if not data and self.tag:
+                    return False
+
+            rect = Rectangle(width, height)
+            rect.data = data
+            rect.setDirty(False)
+
+        result = self.place(rect)
+        if result:
+            self.attach(rect)
+        return result
+
     def reset(self):
         pass
 
+    def resetKeepingTag(self):
+        tag = self.tag
+        self.reset()
+        self.tag = tag
+
     def repack(self):
-        pass
+        rects = sorted(self.rects, reverse=True)
+        self.resetKeepingTag()
+
+        unpacked = []
+        for i in rects:
+            if not self.add(i):
+                unpacked.append(i)
+
+        return unpacked
+
+    def remove(self, rect):
+        self.rects.remove(rect)
+        rect.setOwner(None)
+        self._dirty += 1
+
+        if self.rects:
+            self.freed(rect)
+        else:
+            self.resetKeepingTag()
 
     @property
     def dirty(self):
-        return self._dirty > 0 or any([i.dirty for i in self.rects])
+        return self._dirty > 0 or self.dirtyRects > 0
 
     def setDirty(self, value=True):
         self._dirty = self._dirty + 1 if value else 0
@@ -31,6 +90,19 @@ class Bin:
             for i in self.rects:
                 if hasattr(i, 'setDirty'):
                     i.setDirty(False)
+            self.dirtyRects = 0
+
+    def attach(self, rect):
+        if hasattr(rect, 'setOwner'):
+            rect.setOwner(self)
+        self.rects.append(rect)
+
+    def detachAll(self):
+        for i in self.rects:
+            if hasattr(i, 'setOwner'):
+                i.setOwner(None)
+        self.rects.clear()
+        self.dirtyRects = 0
 
     def __len__(self):
         return len(self.rects)
\ No newline at end of file
@@ -1,8 +1,13 @@
-from .Rectangle import Rectangle
+from .Rectangle import Rect
 from .AbstractBin import Bin
-import sys
 import math
 
+try:
+    from .FreeRects import FreeRects
+except ImportError:
+    # Without NumPy free rects are kept in plain lists
+    from .ListFreeRects import FreeRects
+
 
 class MaxBin(Bin):
     def __init__(self, maxWidth, maxHeight, padding=0, options=None):
@@ -17,71 +22,89 @@ class MaxBin(Bin):
         self.maxWidth = maxWidth
         self.maxHeight = maxHeight
         self.border = self.options['border']
-        self.freeRects.append(Rectangle(
+        self.freeRects = FreeRects()
+        self.freeRects.append(
             self.maxWidth + self.padding - self.border * 2,
             self.maxHeight + self.padding - self.border * 2,
             self.border,
             self.border
-        ))
+        )
 
-        self.stage = Rectangle(self.width, self.height)
+        self.stage = Rect(self.width, self.height)
         self.verticalExpand = self.width > self.height
+        self._growable = None
 
-    def repack(self):
-        unpacked = []
-        self.rects.sort(reverse=True)
+    def freed(self, rect):
+        self.rebuildFreeRects()
 
-        for i in self.rects:
-            if not self.place(i):
-                unpacked.append(i)
+    def rebuildFreeRects(self):
+        # Free space of the current stage split by every placed rect gives
+        # the same maximal free rects as packing from scratch would
+        self.freeRects.clear()
+        width = self.width if self.options['smart'] else self.maxWidth
+        height = self.height if self.options['smart'] else self.maxHeight
+        self.freeRects.append(
+            width + self.padding - self.border * 2,
+            height + self.padding - self.border * 2,
+            self.border,
+            self.border
+        )
 
-        self.reset()
+        for i in self.rects:
+            self.splitNode(Rect(
+                i.width + self.padding, i.height + self.padding, i.x, i.y
+            ))
+            self.pruneFreeList()
 
     def findNode(self, width, height):
-        score = sys.maxsize
-        bestNode = None
-        for i in self.freeRects:
-            if i.width >= width and i.height >= height:
-                areaFit = i.area() - width * height
-                if areaFit < score:
-                    bestNode = Rectangle(width, height, i.x, i.y)
-                    score = areaFit
+        if self.hook:
+            self.hook('findNode', freeRects=len(self.freeRects))
 
-        return bestNode
+        heuristic = self.options['heuristic']
+        bounds = used = None
+        if heuristic == 'contactPoint':
+            bounds = (
+                self.border,
+                self.border,
+                self.maxWidth + self.padding - self.border,
+                self.maxHeight + self.padding - self.border
+            )
+            used = [
+                (i.x, i.y, i.width + self.padding, i.height + self.padding)
+                for i in self.rects
+            ]
+
+        return self.freeRects.findNode(
+            width, height, heuristic, self.options['allowRotation'],
+            bounds, used
+        )
 
     def expandFreeRects(self, width, height):
-        for i in range(len(self.freeRects)):
-            if self.freeRects[i].x + self.freeRects[i].width \
-                    >= min(self.width + self.padding - self.border, width):
-                self.freeRects[i].width = width - \
-                    self.freeRects[i].x - self.border
-
-            if self.freeRects[i].y + self.freeRects[i].height \
-                    >= min(self.height + self.padding - self.border, height):
-                self.freeRects[i].height = height - \
-                    self.freeRects[i].y - self.border
-
-        self.freeRects.append(Rectangle(
+        free = self.freeRects
+        free.expand(
+            min(self.width + self.padding - self.border, width),
+            min(self.height + self.padding - self.border, height),
+            width,
+            height,
+            self.border
+        )
+
+        free.append(
             width - self.width - self.padding,
             height - self.border * 2,
             self.width + self.padding - self.border,
             self.border
-        ))
-        self.freeRects.append(Rectangle(
+        )
+        free.append(
             width - self.border * 2,
             height - self.height - self.padding,
             self.border,
             self.height + self.padding - self.border
-        ))
-        self.freeRects = list(filter(lambda x: not(
-            x.width <= 0 or x.height <= 0 or
-            x.x < self.border or x.y < self.border
-        ), self.freeRects))
+        )
+        free.filter(self.border)
         self.pruneFreeList()
 
-    def updateBinSize(self, node):
-        if not self.options['smart'] or self.stage.contain(node):
-            return False
+    def growSize(self, node):
         tmpWidth = max(self.width, node.x + node.width -
                        self.padding + self.border)
         tmpHeight = max(self.height, node.y + node.height -
@@ -96,89 +119,79 @@ class MaxBin(Bin):
 
         if tmpWidth > self.maxWidth + self.padding or \
                 tmpHeight > self.maxHeight + self.padding:
+            return None
+        return tmpWidth, tmpHeight
+
+    def growthNodes(self, width, height):
+        return (
+            Rect(width, height, self.width + self.padding - self.border,
+                 self.border),
+            Rect(width, height, self.border,
+                 self.height + self.padding - self.border)
+        )
+
+    def canFit(self, rect):
+        # Cheap check, False only when add(rect) is certain to fail
+        if not self.accepts(rect):
             return False
 
-        self.expandFreeRects(tmpWidth + self.padding, tmpHeight + self.padding)
-        self.width = self.stage.width = tmpWidth
-        self.height = self.stage.height = tmpHeight
-        return True
+        width, height = rect.width + self.padding, rect.height + self.padding
+        if self.freeRects.fits(width, height):
+            return True
+        if self.options['allowRotation'] and \
+                self.freeRects.fits(height, width):
+            return True
 
-    def splitNode(self, freeRect, usedNode):
-        if not freeRect.collide(usedNode):
+        return self.growable and any(
+            self.growSize(i) for i in self.growthNodes(width, height)
+        )
+
+    @property
+    def growable(self):
+        # Whether the bin can still grow for the smallest possible rect,
+        # cached until its size changes
+        size = (self.width, self.height)
+        if self._growable is None or self._growable[0] != size:
+            smallest = self.padding + 1
+            self._growable = size, self.options['smart'] and any(
+                self.growSize(i) for i in self.growthNodes(smallest, smallest)
+            )
+        return self._growable[1]
+
+    @property
+    def closed(self):
+        # Nothing fits anymore, not even the smallest possible rect
+        smallest = self.padding + 1
+        return not self.freeRects.fits(smallest, smallest) and \
+            not self.growable
+
+    def updateBinSize(self, node):
+        if not self.options['smart'] or self.stage.contain(node):
             return False
 
-        # Vertical split
-        if usedNode.x < freeRect.x + freeRect.width and \
-                usedNode.x + usedNode.width > freeRect.x:
-            # New node at the top side of the used node
-            if usedNode.y > freeRect.y and \
-                    usedNode.y < freeRect.y + freeRect.height:
-                self.freeRects.append(Rectangle(
-                    freeRect.width,
-                    usedNode.y - freeRect.y,
-                    freeRect.x,
-                    freeRect.y
-                ))
-
-            # New node at the bottom of the used node
-            if usedNode.y + usedNode.height < freeRect.y + freeRect.height:
-                self.freeRects.append(Rectangle(
-                    freeRect.width,
-                    freeRect.y + freeRect.height -
-                    (usedNode.y + usedNode.height),
-                    freeRect.x,
-                    usedNode.y + usedNode.height
-                ))
-
-        # Horizontal split
-        if usedNode.y < freeRect.y + freeRect.height and \
-                usedNode.y + usedNode.height > freeRect.y:
-            # New node at the left side of the used node
-            if usedNode.x > freeRect.x and \
-                    usedNode.x < freeRect.x + freeRect.width:
-                self.freeRects.append(Rectangle(
-                    usedNode.x - freeRect.x,
-                    freeRect.height,
-                    freeRect.x,
-                    freeRect.y
-                ))
-
-            # New node at the right of the used node
-            if usedNode.x + usedNode.width < freeRect.x + freeRect.width:
-                self.freeRects.append(Rectangle(
-                    freeRect.x + freeRect.width -
-                    (usedNode.x + usedNode.width),
-                    freeRect.height,
-                    usedNode.x + usedNode.width,
-                    freeRect.y
-                ))
+        size = self.growSize(node)
+        if size is None:
+            return False
+        tmpWidth, tmpHeight = size
 
+        self.expandFreeRects(tmpWidth + self.padding, tmpHeight + self.padding)
+        self.width = self.stage.width = tmpWidth
+        self.height = self.stage.height = tmpHeight
+        if self.hook:
+            self.hook('grow', width=tmpWidth, height=tmpHeight)
         return True
 
+    def splitNode(self, usedNode):
+        return self.freeRects.split(usedNode)
+
     def pruneFreeList(self):
-        i, j = 0, 0
-        lenR = len(self.freeRects)
-        while (i < lenR):
-            j = i + 1
-            tmpRect1 = self.freeRects[i]
-            while (j < lenR):
-                tmpRect2 = self.freeRects[j]
-                if tmpRect2.contain(tmpRect1):
-                    self.freeRects.remove(tmpRect1)
-                    i -= 1
-                    lenR -= 1
-                    break
-
-                if tmpRect1.contain(tmpRect2):
-                    self.freeRects.remove(tmpRect2)
-                    j -= 1
-                    lenR -= 1
-
-                j += 1
-            i += 1
+        checked, removed = self.freeRects.prune()
+        if self.hook:
+            self.hook('prune', checked=checked, removed=removed,
+                      freeRects=len(self.freeRects))
 
     def place(self, rect):
-        if self.options['tag'] and self.tag != rect.tag:
+        if not self.accepts(rect):
             return False
 
         node = self.findNode(
@@ -187,18 +200,12 @@ class MaxBin(Bin):
 
         if node:
             self.updateBinSize(node)
-            numRectToProcess = len(self.freeRects)
-            i = 0
-
-            while(i < numRectToProcess):
-                if self.splitNode(self.freeRects[i], node):
-                    del self.freeRects[i]
-                    numRectToProcess -= 1
-                    i -= 1
-                i += 1
-
+            self.splitNode(node)
             self.pruneFreeList()
             self.verticalExpand = self.width > self.height
+            if node.width != rect.width + self.padding:
+                rect.width, rect.height = rect.height, rect.width
+                rect.rotated = not rect.rotated
             rect.x = node.x
             rect.y = node.y
             self._dirty += 1
@@ -206,12 +213,12 @@ class MaxBin(Bin):
             return rect
 
         elif not self.verticalExpand:
-            if self.updateBinSize(Rectangle(
+            if self.updateBinSize(Rect(
                 rect.width + self.padding,
                 rect.height + self.padding,
                 self.width + self.padding - self.border,
                 self.border
-            )) or self.updateBinSize(Rectangle(
+            )) or self.updateBinSize(Rect(
                     rect.width + self.padding,
                     rect.height + self.padding,
                     self.border,
@@ -219,12 +226,12 @@ class MaxBin(Bin):
             )):
                 return self.place(rect)
         else:
-            if self.updateBinSize(Rectangle(
+            if self.updateBinSize(Rect(
                 rect.width + self.padding,
                 rect.height + self.padding,
                 self.border,
                 self.height + self.padding - self.border
-            )) or self.updateBinSize(Rectangle(
+            )) or self.updateBinSize(Rect(
                     rect.width + self.padding,
                     rect.height + self.padding,
                     self.width + self.padding - self.border,
@@ -239,37 +246,18 @@ class MaxBin(Bin):
             self.data.clear()
         if self.tag:
             self.tag = None
-        self.rects.clear()
+        self.detachAll()
 
         self.width = 0 if self.options['smart'] else self.maxWidth
         self.height = 0 if self.options['smart'] else self.maxHeight
         self.border = self.options['border']
         self.freeRects.clear()
-        self.freeRects.append(Rectangle(
+        self.freeRects.append(
             self.maxWidth + self.padding - self.border * 2,
             self.maxHeight + self.padding - self.border * 2,
             self.border,
             self.border
-        ))
-        self.stage = Rectangle(self.width, self.height)
+        )
+        self.stage = Rect(self.width, self.height)
+        self.verticalExpand = self.width > self.height
         self._dirty = 0
-
-    def add(self, rect=None, width=None, height=None, data=None):
-        if rect:
-            if self.options['tag'] and self.tag != rect.tag:
-                return False
-        elif width and height:
-            if self.options['tag']:
-                if data and 'tag' in data and self.tag != data['tag']:
-                    return False
-                if not data and self.tag:
-                    return False
-
-            rect = Rectangle(width, height)
-            rect.data = data
-            rect.setDirty(False)
-
-        result = self.place(rect)
-        if result:
-            self.rects.append(rect)
-        return result
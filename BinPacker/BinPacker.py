@@ -1,11 +1,29 @@
 from .Bin import MaxBin
+from .SkylineBin import SkylineBin
 from .OversizedElementBin import OversizedBin
 from .Rectangle import Rectangle
-from random import randint
+from random import Random, randint
+import math
 
 EDGE_MAX_VALUE = 4096
 EDGE_MIN_VALUE = 64
 
+# Keys for the 'sortKey' option, rects are added from the largest value
+SORT_KEYS = {
+    'maxSide': lambda r: (max(r.width, r.height), min(r.width, r.height)),
+    'area': lambda r: r.width * r.height,
+    'perimeter': lambda r: r.width + r.height,
+    'height': lambda r: (r.height, r.width),
+    'width': lambda r: (r.width, r.height)
+}
+
+# Bin types for the 'engine' option. Skyline packs in close to O(n log n)
+# at the cost of some occupancy, e.g. for previews and glyph atlases.
+ENGINES = {
+    'maxRects': MaxBin,
+    'skyline': SkylineBin
+}
+
 
 class BinPacker():
     def __init__(
@@ -23,13 +41,46 @@ class BinPacker():
             'pot': True,
             'square': False,
             'tag': False,
-            'border': 0
+            'border': 0,
+            'allowRotation': False,
+            'heuristic': 'area',
+            # Key of ENGINES used for new bins
+            'engine': 'maxRects',
+            # Every bin gets the same size, the largest one allowed by
+            # width, height, pot and square, e.g. for texture arrays
+            'fixedSize': False,
+            # Order in which addList adds rects, None for the order of
+            # Rectangle, otherwise a key of SORT_KEYS
+            'sortKey': None,
+            # Seed used to shuffle rects instead of sorting them
+            'shuffleSeed': None,
+            # Relative drop of occupancy after remove/update, past which
+            # everything is repacked, None to never repack automatically
+            'repackThreshold': 0.25
         }
         self.bins = []
+        self.names = {}
+        self.usedArea = 0
+        self.packedOccupancy = None
+        # Bins which may still accept new rects, in order of creation
+        self.openBins = []
+        # Optional callable(event, **info) used to collect statistics
+        self.hook = None
 
         if type(options) == dict:
             self.options.update(options)
 
+        if self.options['engine'] not in ENGINES:
+            raise Exception(f"Unknown engine '{self.options['engine']}'")
+
+        if self.options['fixedSize']:
+            self.options['smart'] = False
+            if self.options['pot']:
+                self.width = 2 ** int(math.log2(self.width))
+                self.height = 2 ** int(math.log2(self.height))
+            if self.options['square']:
+                self.width = self.height = min(self.width, self.height)
+
     @property
     def dirty(self):
         for bin in self.bins:
@@ -58,35 +109,70 @@ class BinPacker():
             rect = Rectangle(width, height)
             rect.data = data
 
-        if rect.width > self.width or rect.height > self.height:
+        if self.options['fixedSize'] and self.oversized(rect):
+            raise Exception(
+                f"Rect {rect.width}x{rect.height} is larger than "
+                f"{self.width}x{self.height} page"
+            )
+
+        if type(rect.data) == dict and 'name' in rect.data:
+            self.names[rect.data['name']] = rect
+        self.usedArea += rect.width * rect.height
+
+        if self.oversized(rect):
             self.bins.append(OversizedBin(rect))
+            if self.hook:
+                self.hook('bin', oversized=True)
         else:
             added = False
-            for bin in self.bins:
-                if type(bin) == OversizedBin:
+            for bin in self.openBins:
+                if not bin.canFit(rect):
                     continue
                 added = bin.add(rect)
                 if added:
                     break
 
             if not added:
-                bin = MaxBin(
+                bin = ENGINES[self.options['engine']](
                     self.width, self.height, self.padding, self.options
                 )
+                bin.hook = self.hook
+                if self.hook:
+                    self.hook('bin', oversized=False)
 
                 if self.options['tag'] and rect.tag:
                     bin.tag = rect.tag
 
                 bin.add(rect)
                 self.bins.append(bin)
+                self.openBins.append(bin)
+
+            if bin.closed:
+                self.openBins.remove(bin)
 
         return rect
 
+    def oversized(self, rect):
+        if rect.width <= self.width and rect.height <= self.height:
+            return False
+        return not self.options['allowRotation'] or \
+            rect.height > self.width or rect.width > self.height
+
     def sort(self, rects):
         # if type(rects[0]) == dict:
         #     return sorted(rects, key=lambda x: max(x['width'], x['height']),
         #                   reverse=True)
-        return sorted(rects, reverse=True)
+        if self.options['shuffleSeed'] is not None:
+            rects = list(rects)
+            Random(self.options['shuffleSeed']).shuffle(rects)
+            return rects
+
+        key = self.options['sortKey']
+        if key is None:
+            return sorted(rects, reverse=True)
+        if key not in SORT_KEYS:
+            raise Exception(f"Unknown sort key '{key}'")
+        return sorted(rects, key=SORT_KEYS[key], reverse=True)
 
     def addList(self, rects):
         if len(rects) and type(rects[0]) is not Rectangle:
@@ -98,6 +184,7 @@ class BinPacker():
         for i in self.sort(rects):
             self.add(i)
 
+        self.packedOccupancy = self.occupancy()
         return self
 
     def repack(self):
@@ -106,8 +193,73 @@ class BinPacker():
 
         allRects = self.rects
         self.bins.clear()
+        self.openBins.clear()
+        self.names.clear()
+        self.usedArea = 0
+        for i in allRects:
+            if i.rotated:
+                i.width, i.height = i.height, i.width
+                i.rotated = False
         self.addList(allRects)
 
+    def occupancy(self):
+        area = sum(i.width * i.height for i in self.bins)
+        return self.usedArea / area if area else 1.0
+
+    def get(self, name):
+        if name not in self.names:
+            raise Exception(f"Unknown rect '{name}'")
+        return self.names[name]
+
+    def detach(self, rect):
+        bin = rect.owner
+        bin.remove(rect)
+        self.usedArea -= rect.width * rect.height
+        if not bin.rects:
+            self.bins.remove(bin)
+            if bin in self.openBins:
+                self.openBins.remove(bin)
+        return bin
+
+    def refresh(self):
+        self.openBins = [
+            i for i in self.bins
+            if type(i) is not OversizedBin and not i.closed
+        ]
+
+        threshold = self.options['repackThreshold']
+        if threshold is not None and self.packedOccupancy and \
+                self.occupancy() < self.packedOccupancy * (1 - threshold):
+            self.repack()
+
+    def remove(self, name):
+        rect = self.get(name)
+        del self.names[name]
+        self.detach(rect)
+        self.refresh()
+        return rect
+
+    def update(self, name, width, height):
+        rect = self.get(name)
+        original = (rect.height, rect.width) if rect.rotated else \
+            (rect.width, rect.height)
+        if original == (width, height):
+            return rect
+
+        bin = self.detach(rect)
+        rect.width, rect.height = width, height
+        rect.rotated = False
+
+        # Try to keep the rect in its bin, other bins stay untouched
+        if type(bin) is OversizedBin or self.oversized(rect) or \
+                bin not in self.bins or not bin.add(rect):
+            self.add(rect)
+        else:
+            self.usedArea += width * height
+
+        self.refresh()
+        return rect
+
     def getData(self):
         data = []
         for bin in self.bins:
@@ -117,11 +269,12 @@ class BinPacker():
                     i.data.get('name', randint(0, 99999999999999)): {
                         'pos': (i.x, i.y),
                         'size': (i.width, i.height),
+                        'rotated': i.rotated,
                         'data': i.data,
                     } for i in bin.rects
                 }
             })
-            if len(bin.rects) == 1:
+            if len(bin.rects) == 1 and not self.options['fixedSize']:
                 t = bin.rects[0]
                 data[-1]['size'] = (t.width, t.height)
         return data
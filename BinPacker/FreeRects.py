@@ -0,0 +1,254 @@
+from .LazyImport import lazyImport
+from .Rectangle import Rect
+
+np = lazyImport('numpy')
+
+
+class FreeRects:
+    def __init__(self, capacity=64):
+        # Rows hold x, y, width and height of every free rectangle
+        self.data = np.zeros((4, capacity), np.int64)
+        # Rects added or resized since the last prune
+        self.changed = np.zeros(capacity, bool)
+        self.length = 0
+        self._index = None
+
+    @property
+    def x(self):
+        return self.data[0, :self.length]
+
+    @property
+    def y(self):
+        return self.data[1, :self.length]
+
+    @property
+    def width(self):
+        return self.data[2, :self.length]
+
+    @property
+    def height(self):
+        return self.data[3, :self.length]
+
+    def reserve(self, count):
+        if self.length + count <= self.data.shape[1]:
+            return
+        capacity = max(self.data.shape[1] * 2, self.length + count)
+        data = np.zeros((4, capacity), np.int64)
+        data[:, :self.length] = self.data[:, :self.length]
+        self.data = data
+        changed = np.zeros(capacity, bool)
+        changed[:self.length] = self.changed[:self.length]
+        self.changed = changed
+
+    def append(self, width, height, x=0, y=0):
+        self.reserve(1)
+        self.data[:, self.length] = (x, y, width, height)
+        self.changed[self.length] = True
+        self.length += 1
+        self._index = None
+
+    def extend(self, rects):
+        count = rects.shape[1]
+        self.reserve(count)
+        self.data[:, self.length:self.length + count] = rects
+        self.changed[self.length:self.length + count] = True
+        self.length += count
+        self._index = None
+
+    def keep(self, mask):
+        kept = self.data[:, :self.length][:, mask]
+        changed = self.changed[:self.length][mask]
+        self.length = kept.shape[1]
+        self.data[:, :self.length] = kept
+        self.changed[:self.length] = changed
+        self._index = None
+
+    def touch(self, mask):
+        self.changed[:self.length] |= mask
+        self._index = None
+
+    def expand(self, right, bottom, width, height, border):
+        # Rects reaching right or bottom edge are stretched to the new size
+        grow = self.x + self.width >= right
+        self.width[grow] = width - self.x[grow] - border
+        self.touch(grow)
+
+        grow = self.y + self.height >= bottom
+        self.height[grow] = height - self.y[grow] - border
+        self.touch(grow)
+
+    def clear(self):
+        self.length = 0
+        self._index = None
+
+    def fits(self, width, height):
+        # Whether some free rect is at least width x height, in O(log n)
+        if self._index is None:
+            order = np.argsort(-self.width, kind='stable')
+            self._index = (
+                -self.width[order],
+                np.maximum.accumulate(self.height[order])
+            )
+
+        widths, heights = self._index
+        count = widths.searchsorted(-width, side='right')
+        return bool(count) and heights[count - 1] >= height
+
+    def contact(self, width, height, bounds, used):
+        x, y = self.x, self.y
+        right, bottom = x + width, y + height
+        left, top, maxRight, maxBottom = bounds
+
+        score = (x == left) * height + (right == maxRight) * height + \
+            (y == top) * width + (bottom == maxBottom) * width
+
+        if used:
+            used = np.array(used, np.int64).T
+            ux, uy, uw, uh = (i[:, None] for i in used)
+            overlapX = np.maximum(
+                np.minimum(right, ux + uw) - np.maximum(x, ux), 0
+            )
+            overlapY = np.maximum(
+                np.minimum(bottom, uy + uh) - np.maximum(y, uy), 0
+            )
+            score = score + (
+                ((ux == right) | (ux + uw == x)) * overlapY +
+                ((uy == bottom) | (uy + uh == y)) * overlapX
+            ).sum(axis=0)
+
+        return score
+
+    def score(self, width, height, heuristic, bounds, used):
+        leftoverX = self.width - width
+        leftoverY = self.height - height
+
+        if heuristic == 'area':
+            return self.width * self.height, np.zeros(self.length, np.int64)
+        if heuristic == 'shortSide':
+            return np.minimum(leftoverX, leftoverY), \
+                np.maximum(leftoverX, leftoverY)
+        if heuristic == 'longSide':
+            return np.maximum(leftoverX, leftoverY), \
+                np.minimum(leftoverX, leftoverY)
+        if heuristic == 'bottomLeft':
+            return self.y + height, self.x.copy()
+        if heuristic == 'contactPoint':
+            return -self.contact(width, height, bounds, used), \
+                np.zeros(self.length, np.int64)
+        raise Exception(f"Unknown heuristic '{heuristic}'")
+
+    def findNode(self, width, height, heuristic='area', rotate=False,
+                 bounds=None, used=None):
+        sizes = [(width, height)]
+        if rotate and width != height:
+            sizes.append((height, width))
+
+        # Candidates are ordered by free rect first, orientation second
+        primary = np.empty((self.length, len(sizes)), np.int64)
+        secondary = np.empty((self.length, len(sizes)), np.int64)
+        for i, (w, h) in enumerate(sizes):
+            fits = (self.width >= w) & (self.height >= h)
+            first, second = self.score(w, h, heuristic, bounds, used)
+            primary[:, i] = np.where(fits, first, np.iinfo(np.int64).max)
+            secondary[:, i] = second
+
+        primary, secondary = primary.ravel(), secondary.ravel()
+        if not len(primary):
+            return None
+
+        best = primary.min()
+        if best == np.iinfo(np.int64).max:
+            return None
+
+        i = int(np.where(
+            primary == best, secondary, np.iinfo(np.int64).max
+        ).argmin())
+        w, h = sizes[i % len(sizes)]
+        i //= len(sizes)
+        return Rect(w, h, int(self.x[i]), int(self.y[i]))
+
+    def split(self, node):
+        x, y, w, h = self.x, self.y, self.width, self.height
+        right, bottom = x + w, y + h
+        nodeRight, nodeBottom = node.x + node.width, node.y + node.height
+
+        collide = (node.x < right) & (nodeRight > x) & \
+            (node.y < bottom) & (nodeBottom > y)
+        if not collide.any():
+            return False
+
+        x, y, w, h = x[collide], y[collide], w[collide], h[collide]
+        right, bottom = right[collide], bottom[collide]
+
+        # New rects at the top, bottom, left and right side of the used node,
+        # interleaved per free rect to keep the order of the split loop
+        count = len(x)
+        rects = np.empty((4, count, 4), np.int64)
+        valid = np.empty((count, 4), bool)
+
+        rects[:, :, 0] = (x, y, w, node.y - y)
+        valid[:, 0] = (node.y > y) & (node.y < bottom)
+
+        rects[:, :, 1] = (
+            x, np.full(count, nodeBottom), w, bottom - nodeBottom
+        )
+        valid[:, 1] = nodeBottom < bottom
+
+        rects[:, :, 2] = (x, y, node.x - x, h)
+        valid[:, 2] = (node.x > x) & (node.x < right)
+
+        rects[:, :, 3] = (np.full(count, nodeRight), y, right - nodeRight, h)
+        valid[:, 3] = nodeRight < right
+
+        self.keep(~collide)
+        self.extend(rects[:, valid])
+        return True
+
+    def prune(self):
+        # Pruned rects never contain each other, so only pairs with at least
+        # one rect added or resized since the last prune have to be checked.
+        changed = np.flatnonzero(self.changed[:self.length])
+        self.changed[:self.length] = False
+        if self.length < 2 or not len(changed):
+            return 0, 0
+
+        x, y = self.x, self.y
+        right, bottom = x + self.width, y + self.height
+        cx, cy = x[changed, None], y[changed, None]
+        cRight, cBottom = right[changed, None], bottom[changed, None]
+
+        # containedIn[i, j] - changed rect i is contained in rect j,
+        # contains[i, j] - changed rect i contains rect j
+        containedIn = (cx >= x) & (cy >= y) & \
+            (cRight <= right) & (cBottom <= bottom)
+        contains = (cx <= x) & (cy <= y) & \
+            (cRight >= right) & (cBottom >= bottom)
+        equal = containedIn & contains
+
+        # Of identical rects only the last one is kept
+        index = np.arange(self.length)
+        later = index > changed[:, None]
+        earlier = index < changed[:, None]
+
+        redundant = ((contains & ~equal) | (equal & earlier)).any(axis=0)
+        redundant[changed] |= (
+            (containedIn & ~equal) | (equal & later)
+        ).any(axis=1)
+
+        removed = int(redundant.sum())
+        if removed:
+            self.keep(~redundant)
+        return len(changed), removed
+
+    def filter(self, border):
+        self.keep(~(
+            (self.width <= 0) | (self.height <= 0) |
+            (self.x < border) | (self.y < border)
+        ))
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield Rect(*(int(v) for v in self.data[[2, 3, 0, 1], i]))
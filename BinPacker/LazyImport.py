@@ -0,0 +1,26 @@
+import importlib
+import importlib.util
+import threading
+
+
+class LazyModule:
+    # Imports the module on first attribute access. Unlike LazyLoader of
+    # Python < 3.12 it is safe when first used from several threads at once.
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+def lazyImport(name):
+    # Raises ImportError right away when the module is not installed
+    if importlib.util.find_spec(name) is None:
+        raise ImportError(f"No module named '{name}'")
+    return LazyModule(name)
@@ -0,0 +1,167 @@
+import sys
+
+from .Rectangle import Rect
+
+
+class FreeRects:
+    # Same interface and order of rects as the NumPy based FreeRects, used
+    # when NumPy is not available
+    def __init__(self):
+        self.rects = []
+        # Rects added or resized since the last prune
+        self.changed = []
+
+    def append(self, width, height, x=0, y=0):
+        self.rects.append([x, y, width, height])
+        self.changed.append(True)
+
+    def expand(self, right, bottom, width, height, border):
+        # Rects reaching right or bottom edge are stretched to the new size
+        for i, rect in enumerate(self.rects):
+            if rect[0] + rect[2] >= right:
+                rect[2] = width - rect[0] - border
+                self.changed[i] = True
+            if rect[1] + rect[3] >= bottom:
+                rect[3] = height - rect[1] - border
+                self.changed[i] = True
+
+    def keep(self, mask):
+        self.rects = [i for i, keep in zip(self.rects, mask) if keep]
+        self.changed = [i for i, keep in zip(self.changed, mask) if keep]
+
+    def clear(self):
+        self.rects.clear()
+        self.changed.clear()
+
+    def fits(self, width, height):
+        for x, y, w, h in self.rects:
+            if w >= width and h >= height:
+                return True
+        return False
+
+    def contact(self, x, y, width, height, bounds, used):
+        right, bottom = x + width, y + height
+        left, top, maxRight, maxBottom = bounds
+
+        score = (x == left) * height + (right == maxRight) * height + \
+            (y == top) * width + (bottom == maxBottom) * width
+
+        for ux, uy, uw, uh in used or ():
+            if ux == right or ux + uw == x:
+                score += max(min(bottom, uy + uh) - max(y, uy), 0)
+            if uy == bottom or uy + uh == y:
+                score += max(min(right, ux + uw) - max(x, ux), 0)
+
+        return score
+
+    def score(self, rect, width, height, heuristic, bounds, used):
+        x, y, w, h = rect
+        leftoverX = w - width
+        leftoverY = h - height
+
+        if heuristic == 'area':
+            return w * h, 0
+        if heuristic == 'shortSide':
+            return min(leftoverX, leftoverY), max(leftoverX, leftoverY)
+        if heuristic == 'longSide':
+            return max(leftoverX, leftoverY), min(leftoverX, leftoverY)
+        if heuristic == 'bottomLeft':
+            return y + height, x
+        if heuristic == 'contactPoint':
+            return -self.contact(x, y, width, height, bounds, used), 0
+        raise Exception(f"Unknown heuristic '{heuristic}'")
+
+    def findNode(self, width, height, heuristic='area', rotate=False,
+                 bounds=None, used=None):
+        sizes = [(width, height)]
+        if rotate and width != height:
+            sizes.append((height, width))
+
+        # Candidates are ordered by free rect first, orientation second
+        best = (sys.maxsize, sys.maxsize)
+        bestNode = None
+        for rect in self.rects:
+            for w, h in sizes:
+                if rect[2] < w or rect[3] < h:
+                    continue
+                score = self.score(rect, w, h, heuristic, bounds, used)
+                if score < best:
+                    best = score
+                    bestNode = Rect(w, h, rect[0], rect[1])
+
+        return bestNode
+
+    def split(self, node):
+        nodeRight, nodeBottom = node.x + node.width, node.y + node.height
+
+        kept, keptChanged, added = [], [], []
+        for rect, changed in zip(self.rects, self.changed):
+            x, y, w, h = rect
+            right, bottom = x + w, y + h
+            if node.x >= right or nodeRight <= x or \
+                    node.y >= bottom or nodeBottom <= y:
+                kept.append(rect)
+                keptChanged.append(changed)
+                continue
+
+            # New rects at the top, bottom, left and right side of the node
+            if y < node.y < bottom:
+                added.append([x, y, w, node.y - y])
+            if nodeBottom < bottom:
+                added.append([x, nodeBottom, w, bottom - nodeBottom])
+            if x < node.x < right:
+                added.append([x, y, node.x - x, h])
+            if nodeRight < right:
+                added.append([nodeRight, y, right - nodeRight, h])
+
+        if len(kept) == len(self.rects):
+            return False
+
+        self.rects = kept + added
+        self.changed = keptChanged + [True] * len(added)
+        return True
+
+    def prune(self):
+        # Pruned rects never contain each other, so only pairs with at least
+        # one rect added or resized since the last prune have to be checked.
+        changed = [i for i, value in enumerate(self.changed) if value]
+        self.changed = [False] * len(self.rects)
+        if len(self.rects) < 2 or not changed:
+            return 0, 0
+
+        # Of identical rects only the last one is kept
+        redundant = [False] * len(self.rects)
+        for i in changed:
+            x, y, w, h = self.rects[i]
+            for j, (jx, jy, jw, jh) in enumerate(self.rects):
+                containedIn = x >= jx and y >= jy and \
+                    x + w <= jx + jw and y + h <= jy + jh
+                contains = x <= jx and y <= jy and \
+                    x + w >= jx + jw and y + h >= jy + jh
+                if containedIn and contains:
+                    if j < i:
+                        redundant[j] = True
+                    elif j > i:
+                        redundant[i] = True
+                elif contains:
+                    redundant[j] = True
+                elif containedIn:
+                    redundant[i] = True
+
+        removed = sum(redundant)
+        if removed:
+            self.keep([not i for i in redundant])
+        return len(changed), removed
+
+    def filter(self, border):
+        self.keep([
+            w > 0 and h > 0 and x >= border and y >= border
+            for x, y, w, h in self.rects
+        ])
+
+    def __len__(self):
+        return len(self.rects)
+
+    def __iter__(self):
+        for x, y, w, h in self.rects:
+            yield Rect(w, h, x, y)
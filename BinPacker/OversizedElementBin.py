@@ -17,7 +17,7 @@ class OversizedBin(Bin):
             rect.data = data
 
         rect.oversized = True
-        self.rects.append(rect)
+        self.attach(rect)
         self.maxWidth = self.width
         self.maxHeight = self.height
         self.options['smart'] = self.options['pot'] = \
@@ -30,4 +30,9 @@ class OversizedBin(Bin):
         pass
 
     def repack(self):
-        return None
+        return []
+
+    def remove(self, rect):
+        self.rects.remove(rect)
+        rect.setOwner(None)
+        self._dirty += 1
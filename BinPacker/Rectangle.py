@@ -1,3 +1,29 @@
+class Rect:
+    # Untracked rectangle used for bookkeeping inside of bins
+    __slots__ = ('x', 'y', 'width', 'height')
+
+    def __init__(self, width=0, height=0, x=0, y=0):
+        self.width = width
+        self.height = height
+        self.x = x
+        self.y = y
+
+    def collide(self, r):
+        return (r.x < self.x + self.width and
+                r.x + r.width > self.x and
+                r.y < self.y + self.height and
+                r.y + r.height > self.y)
+
+    def contain(self, r):
+        return (r.x >= self.x and
+                r.y >= self.y and
+                r.x + r.width <= self.x + self.width and
+                r.y + r.height <= self.y + self.height)
+
+    def area(self):
+        return self.width * self.height
+
+
 class Rectangle:
     _x = 0
     _y = 0
@@ -5,6 +31,7 @@ class Rectangle:
     _height = 0
     _data = None
     _dirty = 0
+    _owner = None
 
     def __init__(self, width=0, height=0, x=0, y=0, data=None):
         self.width = width
@@ -14,6 +41,7 @@ class Rectangle:
         self._dirty = 0
         self.data = data
         self.oversized = 0
+        self.rotated = False
         if type(data) == dict:
             self.tag = data.get('tag', None)
         else:
@@ -47,7 +75,7 @@ class Rectangle:
         if val == self._width:
             return
         self._width = val
-        self._dirty += 1
+        self.touch()
 
     @property
     def height(self):
@@ -58,7 +86,7 @@ class Rectangle:
         if val == self._height:
             return
         self._height = val
-        self._dirty += 1
+        self.touch()
 
     @property
     def x(self):
@@ -69,7 +97,7 @@ class Rectangle:
         if val == self._x:
             return
         self._x = val
-        self._dirty += 1
+        self.touch()
 
     @property
     def y(self):
@@ -80,7 +108,7 @@ class Rectangle:
         if val == self._y:
             return
         self._y = val
-        self._dirty += 1
+        self.touch()
 
     @property
     def data(self):
@@ -91,10 +119,31 @@ class Rectangle:
         if val == self._data:
             return
         self._data = val
+        self.touch()
+
+    @property
+    def owner(self):
+        return self._owner
+
+    def touch(self):
+        if not self._dirty and self._owner is not None:
+            self._owner.dirtyRects += 1
         self._dirty += 1
 
+    def setOwner(self, owner):
+        if self._dirty and self._owner is not None:
+            self._owner.dirtyRects -= 1
+        self._owner = owner
+        if self._dirty and owner is not None:
+            owner.dirtyRects += 1
+
     def setDirty(self, value):
-        self._dirty = self._dirty + 1 if value else 0
+        if value:
+            self.touch()
+            return
+        if self._dirty and self._owner is not None:
+            self._owner.dirtyRects -= 1
+        self._dirty = 0
 
     def __lt__(self, val):
         r = max(val.width, val.height) - max(self.width, self.height)
@@ -0,0 +1,235 @@
+from .Rectangle import Rect
+from .AbstractBin import Bin
+from .Bin import FreeRects
+import math
+
+# Waste rects kept per bin, the smallest ones are dropped past twice as many
+# to keep lookups cheap
+WASTE_LIMIT = 256
+
+
+class SkylineBin(Bin):
+    # Bottom-left skyline packer. Space left below the skyline when a rect
+    # is placed over lower segments goes to a waste map, which is tried
+    # first for the following rects.
+    def __init__(self, maxWidth, maxHeight, padding=0, options=None):
+        super().__init__()
+
+        if type(options) == dict:
+            self.options.update(options)
+
+        self.padding = padding
+        self.maxWidth = maxWidth
+        self.maxHeight = maxHeight
+        self.waste = FreeRects()
+        self.reset()
+
+    def reset(self):
+        if self.data:
+            self.data.clear()
+        if self.tag:
+            self.tag = None
+        self.detachAll()
+
+        self.width = 0 if self.options['smart'] else self.maxWidth
+        self.height = 0 if self.options['smart'] else self.maxHeight
+        self.border = self.options['border']
+        self.right = self.maxWidth + self.padding - self.border
+        self.bottom = self.maxHeight + self.padding - self.border
+        # Segments of the skyline as [x, y, width], ordered by x
+        self.skyline = [[self.border, self.border, self.right - self.border]]
+        self.lowest = self.border
+        self.usedRight = self.usedBottom = 0
+        # Sizes which didn't fit on the skyline. It only ever rises, so
+        # they never will and neither will anything larger.
+        self.blocked = []
+        self.waste.clear()
+        self._dirty = 0
+
+    def freed(self, rect):
+        # Freed space can't be returned to the skyline, it is wasted instead
+        self.waste.append(
+            rect.width + self.padding, rect.height + self.padding,
+            rect.x, rect.y
+        )
+        self.waste.prune()
+
+    def isBlocked(self, width, height):
+        for w, h in self.blocked:
+            if width >= w and height >= h:
+                return True
+        return False
+
+    def findPosition(self, width, height):
+        if self.isBlocked(width, height):
+            return None
+
+        best = None
+        skyline = self.skyline
+        for i in range(len(skyline)):
+            x, y, _ = skyline[i]
+            if x + width > self.right:
+                break
+            # The rect can't sit lower than this segment
+            if best is not None and y + height >= best[0][0]:
+                continue
+
+            # Lowest y at which the rect clears every segment below it
+            j, end = i, x + width
+            while skyline[j][0] + skyline[j][2] < end:
+                j += 1
+                if skyline[j][1] > y:
+                    y = skyline[j][1]
+
+            if y + height <= self.bottom and \
+                    (best is None or (y + height, x) < best[0]):
+                best = (y + height, x), i, y
+
+        if best is None:
+            self.blocked = [
+                i for i in self.blocked if i[0] < width or i[1] < height
+            ]
+            self.blocked.append((width, height))
+        return best
+
+    def findNode(self, width, height):
+        if self.hook:
+            self.hook('skyline', segments=len(self.skyline),
+                      waste=len(self.waste))
+
+        sizes = [(width, height)]
+        if self.options['allowRotation'] and width != height:
+            sizes.append((height, width))
+
+        if len(self.waste) and any(self.waste.fits(*i) for i in sizes):
+            heuristic = self.options['heuristic']
+            if heuristic == 'contactPoint':
+                heuristic = 'bottomLeft'
+            node = self.waste.findNode(
+                width, height, heuristic, self.options['allowRotation']
+            )
+            self.waste.split(node)
+            self.waste.prune()
+            return node
+
+        best = None
+        for w, h in sizes:
+            found = self.findPosition(w, h)
+            if found and (best is None or found[0] < best[0][0]):
+                best = found, w, h
+        if best is None:
+            return None
+
+        (_, i, y), w, h = best
+        node = Rect(w, h, self.skyline[i][0], y)
+        self.addSkylineLevel(i, node)
+        return node
+
+    def addSkylineLevel(self, index, node):
+        skyline = self.skyline
+        end = node.x + node.width
+
+        # Gaps between covered segments and the node are wasted, unless
+        # they are too thin for even a 1x1 rect
+        j = index
+        while j < len(skyline) and skyline[j][0] < end:
+            x, y, w = skyline[j]
+            w = min(x + w, end) - x
+            if node.y - y > self.padding and w > self.padding:
+                self.waste.append(w, node.y - y, x, y)
+            j += 1
+
+        if len(self.waste) > WASTE_LIMIT * 2:
+            self.trimWaste()
+
+        last = skyline[j - 1]
+        covered = min(i[1] for i in skyline[index:j])
+        segments = [[node.x, node.y + node.height, node.width]]
+        if last[0] + last[2] > end:
+            segments.append([end, last[1], last[0] + last[2] - end])
+        skyline[index:j] = segments
+
+        # Neighbours at the same level are merged
+        start = max(index - 1, 0)
+        i = start
+        while i < min(start + 3, len(skyline) - 1):
+            if skyline[i][1] == skyline[i + 1][1]:
+                skyline[i][2] += skyline[i + 1][2]
+                del skyline[i + 1]
+            else:
+                i += 1
+
+        if covered == self.lowest:
+            self.lowest = min(i[1] for i in skyline)
+
+    def trimWaste(self):
+        areas = sorted(
+            (i.width * i.height for i in self.waste), reverse=True
+        )
+        smallest = areas[WASTE_LIMIT - 1]
+        self.waste.keep([i.width * i.height >= smallest for i in self.waste])
+
+    def canFit(self, rect):
+        # Cheap check, False only when add(rect) is certain to fail
+        if not self.accepts(rect):
+            return False
+
+        width, height = rect.width + self.padding, rect.height + self.padding
+        smallest = min(width, height) if self.options['allowRotation'] \
+            else height
+        if self.lowest + smallest <= self.bottom and not (
+                self.isBlocked(width, height) and
+                (not self.options['allowRotation'] or
+                 self.isBlocked(height, width))
+        ):
+            return True
+
+        return len(self.waste) > 0 and (
+            self.waste.fits(width, height) or
+            self.options['allowRotation'] and self.waste.fits(height, width)
+        )
+
+    @property
+    def closed(self):
+        # Nothing fits anymore, not even the smallest possible rect
+        smallest = self.padding + 1
+        return self.lowest + smallest > self.bottom and \
+            not (len(self.waste) and self.waste.fits(smallest, smallest))
+
+    def updateBinSize(self, node):
+        self.usedRight = max(self.usedRight, node.x + node.width)
+        self.usedBottom = max(self.usedBottom, node.y + node.height)
+        if not self.options['smart']:
+            return
+
+        width = self.usedRight - self.padding + self.border
+        height = self.usedBottom - self.padding + self.border
+        if self.options['pot']:
+            width = min(2 ** math.ceil(math.log2(width)), self.maxWidth)
+            height = min(2 ** math.ceil(math.log2(height)), self.maxHeight)
+        if self.options['square']:
+            width = height = max(width, height)
+
+        if (width, height) != (self.width, self.height):
+            self.width, self.height = width, height
+            if self.hook:
+                self.hook('grow', width=width, height=height)
+
+    def place(self, rect):
+        if not self.accepts(rect):
+            return False
+
+        node = self.findNode(
+            rect.width + self.padding, rect.height + self.padding
+        )
+        if not node:
+            return False
+
+        self.updateBinSize(node)
+        if node.width != rect.width + self.padding:
+            rect.width, rect.height = rect.height, rect.width
+            rect.rotated = not rect.rotated
+        rect.x = node.x
+        rect.y = node.y
+        self._dirty += 1
+        return rect
@@ -0,0 +1,159 @@
+import argparse
+import json
+import platform
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+from BinPacker.BinPacker import ENGINES
+
+from . import packing, pipeline
+from .distributions import DISTRIBUTIONS
+
+
+def option(x: str):
+    key, _, value = x.partition('=')
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+argParser = argparse.ArgumentParser(
+    "benchmarks", description="Benchmark BinPacker and the packer pipeline"
+)
+commands = argParser.add_subparsers(dest='command', required=True)
+
+runParser = commands.add_parser('run', help="Run benchmarks")
+runParser.add_argument('-o', '--output', default=None, type=str,
+                       help="JSON file for results, stdout otherwise")
+runParser.add_argument('-d', '--distribution', action='append',
+                       choices=list(DISTRIBUTIONS),
+                       help="Rect distribution, all by default")
+runParser.add_argument('-n', '--count', default=None, type=int,
+                       help="Number of rects, default depends on "
+                            "distribution")
+runParser.add_argument('-s', '--seed', default=0, type=int)
+runParser.add_argument('-r', '--repeat', default=3, type=int,
+                       help="Packing runs, the fastest one is reported")
+runParser.add_argument('-mw', '--max-width', default=2048, type=int)
+runParser.add_argument('-mh', '--max-height', default=2048, type=int)
+runParser.add_argument('-p', '--padding', default=2, type=int)
+runParser.add_argument('-O', '--option', action='append', type=option,
+                       default=[], help="BinPacker option as key=value")
+runParser.add_argument('-E', '--engine', action='append',
+                       choices=list(ENGINES),
+                       help="Packing engine, may be repeated to compare "
+                            "engines")
+runParser.add_argument('--pipeline', default=False, action='store_true',
+                       help="Also run end-to-end benchmarks on generated "
+                            "images")
+runParser.add_argument('--images', default=300, type=int,
+                       help="Number of images for pipeline benchmarks")
+runParser.add_argument('-j', '--jobs', default=1, type=int)
+runParser.add_argument('-f', '--outFormat', default='png', type=str)
+runParser.add_argument('-e', '--profile', default='default', type=str)
+runParser.add_argument('--no-memory', default=False, action='store_true',
+                       help="Do not trace memory in pipeline benchmarks")
+
+compareParser = commands.add_parser(
+    'compare', help="Compare two result files"
+)
+compareParser.add_argument('baseline', type=str)
+compareParser.add_argument('current', type=str)
+compareParser.add_argument('-t', '--threshold', default=0.1, type=float,
+                           help="Allowed relative slowdown")
+
+
+def summary(result: Dict) -> str:
+    engine = result['options'].get('engine', 'maxRects')
+    return (f"{result['kind']}/{result['distribution']:16} {engine:9} "
+            f"time {result['time']:9.4f}s  sheets {result['sheets']:3}  "
+            f"occupancy {result['occupancy']:.4f}")
+
+
+def run(args: argparse.Namespace) -> Dict:
+    options = dict(args.option)
+    results = []
+    for distribution in args.distribution or DISTRIBUTIONS:
+        for engine in args.engine or [None]:
+            engineOptions = dict(options)
+            if engine:
+                engineOptions['engine'] = engine
+            results.append(packing.benchmark(
+                distribution, args.count, args.seed, args.max_width,
+                args.max_height, args.padding, engineOptions, args.repeat
+            ))
+            print(summary(results[-1]), file=sys.stderr)
+        if args.pipeline:
+            results.append(pipeline.benchmark(
+                distribution, args.images, args.seed, args.max_width,
+                args.max_height, args.padding, options, args.jobs,
+                args.outFormat, args.profile, not args.no_memory
+            ))
+
+    return {
+        'python': sys.version,
+        'platform': platform.platform(),
+        'results': results
+    }
+
+
+def key(result: Dict) -> str:
+    return json.dumps([
+        result['kind'], result['distribution'], result['count'],
+        result['seed'], result['size'], result['padding'],
+        result['options'], result.get('jobs'), result.get('outFormat'),
+        result.get('profile')
+    ], sort_keys=True)
+
+
+def compare(baseline: Dict, current: Dict, threshold: float) -> List[str]:
+    regressions = []
+    old = {key(i): i for i in baseline['results']}
+    for new in current['results']:
+        prev = old.get(key(new))
+        if prev is None:
+            continue
+
+        name = f"{new['kind']}/{new['distribution']}"
+        if 'engine' in new['options']:
+            name += f"/{new['options']['engine']}"
+        ratio = new['time'] / prev['time'] if prev['time'] else 1.0
+        print(f"{name:24} time {prev['time']:9.4f}s -> {new['time']:9.4f}s "
+              f"({ratio:5.2f}x)  sheets {prev['sheets']} -> {new['sheets']}"
+              f"  occupancy {prev['occupancy']:.4f} -> "
+              f"{new['occupancy']:.4f}")
+
+        if ratio > 1 + threshold:
+            regressions.append(f'{name}: {ratio:.2f}x slower')
+        if new['sheets'] > prev['sheets']:
+            regressions.append(f'{name}: more sheets')
+        if new['occupancy'] < prev['occupancy']:
+            regressions.append(f'{name}: lower occupancy')
+
+    return regressions
+
+
+def main() -> int:
+    args = argParser.parse_args()
+    if args.command == 'run':
+        results = json.dumps(run(args), indent=4)
+        if args.output:
+            Path(args.output).write_text(results)
+        else:
+            print(results)
+        return 0
+
+    regressions = compare(
+        json.loads(Path(args.baseline).read_text()),
+        json.loads(Path(args.current).read_text()),
+        args.threshold
+    )
+    for i in regressions:
+        print(f'REGRESSION {i}')
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
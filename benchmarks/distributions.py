@@ -0,0 +1,73 @@
+import random
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+def uniform(rng: random.Random) -> Tuple[int, int]:
+    return rng.randint(8, 256), rng.randint(8, 256)
+
+
+def longTailed(rng: random.Random) -> Tuple[int, int]:
+    return (min(int(rng.paretovariate(1.5) * 12), 1024),
+            min(int(rng.paretovariate(1.5) * 12), 1024))
+
+
+def manyTiny(rng: random.Random) -> Tuple[int, int]:
+    return rng.randint(2, 24), rng.randint(2, 24)
+
+
+def fewHuge(rng: random.Random) -> Tuple[int, int]:
+    if rng.random() < 0.1:
+        return rng.randint(512, 1536), rng.randint(512, 1536)
+    return rng.randint(16, 128), rng.randint(16, 128)
+
+
+DISTRIBUTIONS: Dict[str, Tuple[Callable, int]] = {
+    # name: (size generator, default count)
+    'uniform': (uniform, 2000),
+    'longTailed': (longTailed, 3000),
+    'manyTiny': (manyTiny, 20000),
+    'fewHuge': (fewHuge, 300),
+}
+
+
+def rects(distribution: str, count: int = None, seed: int = 0) -> List[Dict]:
+    generator, defaultCount = DISTRIBUTIONS[distribution]
+    rng = random.Random(seed)
+    return [
+        {
+            'width': width,
+            'height': height,
+            'data': {'name': f'{distribution}{i}'}
+        } for i, (width, height) in enumerate(
+            generator(rng) for _ in range(count or defaultCount)
+        )
+    ]
+
+
+def imageCorpus(
+        path: Path,
+        distribution: str,
+        count: int = None,
+        seed: int = 0
+) -> List[Path]:
+    rng = np.random.default_rng(seed)
+    files = []
+    for i in rects(distribution, count, seed):
+        width, height = i['width'], i['height']
+        pixels = rng.integers(0, 256, (height, width, 4), np.uint8)
+
+        # Transparent margins of random size, so there is something to trim
+        top = int(rng.integers(0, height // 4 + 1))
+        left = int(rng.integers(0, width // 4 + 1))
+        pixels[..., 3] = 0
+        pixels[top:height - top, left:width - left, 3] = 255
+
+        file = Path(path, f"{i['data']['name']}.png")
+        Image.fromarray(pixels, 'RGBA').save(file, compress_level=1)
+        files.append(file)
+
+    return files
@@ -0,0 +1,45 @@
+from time import perf_counter
+from typing import Dict
+
+from BinPacker.BinPacker import BinPacker
+
+from .distributions import rects
+
+
+def occupancy(packer: BinPacker) -> float:
+    used = sum(i.width * i.height for i in packer.rects)
+    area = sum(i.width * i.height for i in packer.bins)
+    return used / area if area else 0.0
+
+
+def benchmark(
+        distribution: str,
+        count: int = None,
+        seed: int = 0,
+        width: int = 2048,
+        height: int = 2048,
+        padding: int = 2,
+        options: Dict = None,
+        repeat: int = 3
+) -> Dict:
+    data = rects(distribution, count, seed)
+    times = []
+    for _ in range(repeat):
+        packer = BinPacker(width, height, padding, options)
+        start = perf_counter()
+        packer.addList(data)
+        times.append(perf_counter() - start)
+
+    return {
+        'kind': 'packing',
+        'distribution': distribution,
+        'count': len(data),
+        'seed': seed,
+        'size': [width, height],
+        'padding': padding,
+        'options': options or {},
+        'time': min(times),
+        'times': times,
+        'sheets': len(packer.bins),
+        'occupancy': occupancy(packer)
+    }
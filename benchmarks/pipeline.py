@@ -0,0 +1,101 @@
+import tracemalloc
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable, Dict
+
+import packer
+from BinPacker.BinPacker import BinPacker
+from exporters import getExporter
+
+from .distributions import imageCorpus
+from .packing import occupancy
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def measure(stages: Dict, name: str, function: Callable, *args):
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    start = perf_counter()
+    result = function(*args)
+    stages[name] = {'time': perf_counter() - start}
+    if tracemalloc.is_tracing():
+        stages[name]['peakMemory'] = tracemalloc.get_traced_memory()[1]
+    return result
+
+
+def benchmark(
+        distribution: str,
+        count: int = None,
+        seed: int = 0,
+        width: int = 2048,
+        height: int = 2048,
+        padding: int = 2,
+        options: Dict = None,
+        jobs: int = 1,
+        outFormat: str = 'png',
+        profile: str = 'default',
+        memory: bool = True
+) -> Dict:
+    # Peak memory is traced with tracemalloc, which covers NumPy buffers but
+    # neither Pillow internals nor worker processes, and slows Python code.
+    stages = {}
+    with TemporaryDirectory() as source, TemporaryDirectory() as out:
+        files = imageCorpus(Path(source), distribution, count, seed)
+
+        if memory:
+            tracemalloc.start()
+        store = packer.SpriteStore()
+        try:
+            images = measure(
+                stages, 'clean', packer.cleanImages, files, store, jobs
+            )
+            sizes = [
+                {
+                    'width': images[i]['_width'],
+                    'height': images[i]['_height'],
+                    'data': {'name': i}
+                } for i in images
+            ]
+
+            binPacker = BinPacker(width, height, padding, options)
+            data = measure(
+                stages, 'pack',
+                lambda: binPacker.addList(sizes).getData()
+            )
+            measure(
+                stages, 'export', getExporter('json'), data, images, Path(out),
+                outFormat, None
+            )
+            measure(stages, 'save', lambda: [
+                packer.saveSheet(
+                    sheet, store, [Path(out, f'{i}.{outFormat}')], profile
+                ) for i, sheet in enumerate(data)
+            ])
+        finally:
+            store.close()
+            if memory:
+                tracemalloc.stop()
+
+    return {
+        'kind': 'pipeline',
+        'distribution': distribution,
+        'count': len(files),
+        'seed': seed,
+        'size': [width, height],
+        'padding': padding,
+        'options': options or {},
+        'jobs': jobs,
+        'outFormat': outFormat,
+        'profile': profile,
+        'time': sum(i['time'] for i in stages.values()),
+        'stages': stages,
+        'maxRss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if resource else None,
+        'sheets': len(data),
+        'occupancy': occupancy(binPacker)
+    }
@@ -0,0 +1,82 @@
+import filecmp
+import importlib
+import os
+from pathlib import Path
+from typing import Callable, Dict, List, Union
+
+# Exporters are imported only when chosen, so their dependencies (like lxml)
+# are never loaded by runs which don't use them. Values are either
+# 'module:function' or the exporter itself, each exporter is called with
+# (data, images, outFolder, outFormat, repNames, aliases).
+EXPORTERS: Dict[str, Union[str, Callable]] = {
+    'json': 'exporters.jsonExporter:toJson',
+    'xml': 'exporters.xmlExporter:toXml',
+    'binary': 'exporters.binaryExporter:toBinary'
+}
+
+
+def register(name: str, exporter: Union[str, Callable]) -> None:
+    EXPORTERS[name] = exporter
+
+
+def getExporter(name: str) -> Callable:
+    # Names outside of the registry may point to a plugin directly
+    exporter = EXPORTERS.get(name, name)
+    if callable(exporter):
+        return exporter
+
+    module, _, function = exporter.partition(':')
+    if not function:
+        raise ValueError(f"Unknown exporter '{name}'")
+    return getattr(importlib.import_module(module), function)
+
+
+def getName(name: str, repNames: Dict[str, str]) -> str:
+    if repNames is None or name not in repNames:
+        return name
+    return repNames[name]
+
+
+def writeIfChanged(path: Path, content: bytes) -> bool:
+    if path.exists() and path.read_bytes() == content:
+        return False
+    path.write_bytes(content)
+    return True
+
+
+def writeStreamIfChanged(path: Path, chunks) -> bool:
+    tmp = path.with_name(f'{path.name}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as file:
+        for chunk in chunks:
+            file.write(chunk)
+
+    if path.exists() and filecmp.cmp(tmp, path, shallow=False):
+        tmp.unlink()
+        return False
+    os.replace(tmp, path)
+    return True
+
+
+def spriteEntries(
+        sheetData: Dict,
+        images,
+        repNames: Dict[str, str],
+        aliases: Dict[str, List[str]] = None
+):
+    # Yields exported name, entry and image name of every sprite, aliases
+    # right after the sprite they point to
+    for j, rect in sheetData['rects'].items():
+        name = getName(j, repNames)
+        entry = {}
+        entry['x'], entry['y'] = rect['pos']
+        entry['width'], entry['height'] = rect['size']
+        entry['pad_x'], entry['pad_y'], *_ = images[j]['padding']
+        if rect.get('rotated'):
+            entry['rotated'] = True
+        yield name, entry, j
+
+        for k in (aliases or {}).get(j, []):
+            alias = dict(entry)
+            alias['pad_x'], alias['pad_y'], *_ = images[k]['padding']
+            alias['alias'] = name
+            yield getName(k, repNames), alias, k
@@ -0,0 +1,87 @@
+import struct
+from pathlib import Path
+from typing import Dict, List
+
+from . import spriteEntries, writeIfChanged
+
+# Binary data: header, sheets (name offset, name length, width, height),
+# records (name offset, name length, sheet, x, y, width, height, pad x,
+# pad y, original width, original height, flags), hash index of FNV-1a of
+# names with linear probing and string table, all little-endian uint32
+META_HEADER = struct.Struct('<4sHHIIIIIII')
+META_SHEET = struct.Struct('<4I')
+META_RECORD = struct.Struct('<12I')
+META_MAGIC = b'SPRM'
+META_VERSION = 1
+META_ROTATED = 1
+META_ALIAS = 2
+
+
+def fnv1a(content: bytes) -> int:
+    value = 0x811c9dc5
+    for i in content:
+        value = ((value ^ i) * 0x01000193) & 0xffffffff
+    return value
+
+
+def toBinary(
+        data: list,
+        images,
+        outFolder: Path,
+        outFormat: str,
+        repNames: Dict[str, str],
+        aliases: Dict[str, List[str]] = None
+) -> None:
+    strings = bytearray()
+    sheets = []
+    records = []
+    names = []
+    for out, sheetData in enumerate(data):
+        name = f'{out}.{outFormat}'.encode()
+        sheets.append((len(strings), len(name), *sheetData['size']))
+        strings += name
+
+        entries = spriteEntries(sheetData, images, repNames, aliases)
+        for name, entry, j in entries:
+            name = name.encode()
+            flags = META_ROTATED if entry.get('rotated') else 0
+            if 'alias' in entry:
+                flags |= META_ALIAS
+            records.append((
+                len(strings), len(name), out, entry['x'], entry['y'],
+                entry['width'], entry['height'], entry['pad_x'],
+                entry['pad_y'], images[j]['width'], images[j]['height'],
+                flags
+            ))
+            names.append(name)
+            strings += name
+
+    # Open addressing with linear probing, slots hold record index + 1
+    slots = 1
+    while slots < len(records) * 2:
+        slots *= 2
+    index = [0] * slots
+    for i, name in enumerate(names):
+        slot = fnv1a(name) & (slots - 1)
+        while index[slot]:
+            slot = (slot + 1) & (slots - 1)
+        index[slot] = i + 1
+
+    sheetTable = b''.join(META_SHEET.pack(*i) for i in sheets)
+    recordTable = b''.join(META_RECORD.pack(*i) for i in records)
+    indexTable = struct.pack(f'<{slots}I', *index)
+    sheetOffset = META_HEADER.size
+    recordOffset = sheetOffset + len(sheetTable)
+    indexOffset = recordOffset + len(recordTable)
+    stringOffset = indexOffset + len(indexTable)
+
+    writeIfChanged(outFolder / 'spritesheet.bin', b''.join((
+        META_HEADER.pack(
+            META_MAGIC, META_VERSION, 0, len(sheets), len(records), slots,
+            sheetOffset, recordOffset, indexOffset, stringOffset
+        ),
+        sheetTable,
+        recordTable,
+        indexTable,
+        bytes(strings)
+    )))
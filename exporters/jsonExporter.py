@@ -0,0 +1,35 @@
+import json
+from pathlib import Path
+from typing import Dict, List
+
+from . import spriteEntries, writeStreamIfChanged
+
+
+def toJson(
+        data: list,
+        images,
+        outFolder: Path,
+        outFormat: str,
+        repNames: Dict[str, str],
+        aliases: Dict[str, List[str]] = None
+) -> None:
+    # Written entry by entry, same output as json.dumps(..., indent=4).
+    # Entries are flat, so separators give the indentation without the
+    # slow pure Python encoder used for indent.
+    indent = '\n' + ' ' * 8
+    separators = (',' + indent + ' ' * 4, ': ')
+
+    def chunks():
+        yield '{'
+        for out, sheetData in enumerate(data):
+            yield f'{"," if out else ""}\n    ' \
+                f'{json.dumps(f"{out}.{outFormat}")}: {{'
+            entries = spriteEntries(sheetData, images, repNames, aliases)
+            for i, (name, entry, _) in enumerate(entries):
+                entry = json.dumps(entry, separators=separators)[1:-1]
+                yield f'{"," if i else ""}{indent}{json.dumps(name)}: ' \
+                    f'{{{separators[0][1:]}{entry}{indent}}}'
+            yield '\n    }'
+        yield '\n}' if data else '}'
+
+    writeStreamIfChanged(outFolder / 'spritesheet.json', chunks())
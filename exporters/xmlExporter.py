@@ -0,0 +1,51 @@
+from pathlib import Path
+from typing import Dict, List
+
+import lxml.etree as et
+
+from . import getName, writeIfChanged
+
+
+def toXml(
+        data: list,
+        images,
+        outFolder: Path,
+        outFormat: str,
+        repNames: Dict[str, str],
+        aliases: Dict[str, List[str]] = None
+) -> None:
+    out = 0
+    root = et.Element('spritesheets')
+    for i in range(len(data)):
+        sheet: et.Element = et.Element('sheet', attrib={
+            'name': f'{out}.{outFormat}'
+        })
+        root.append(sheet)
+        out += 1
+        for j in data[i]['rects'].keys():
+            attribs = {}
+            attribs['n'] = getName(j, repNames)
+            attribs['x'], attribs['y'] = data[i]['rects'][j]['pos']
+            attribs['w'], attribs['h'] = data[i]['rects'][j]['size']
+            attribs['px'], attribs['py'], *_ = images[j]['padding']
+            if data[i]['rects'][j].get('rotated'):
+                attribs['r'] = 1
+
+            elem = et.Element('img', attrib={
+                k: str(v) for k, v in attribs.items()
+            })
+            sheet.append(elem)
+
+            for k in (aliases or {}).get(j, []):
+                aliasAttribs = dict(attribs)
+                aliasAttribs['n'] = getName(k, repNames)
+                aliasAttribs['px'], aliasAttribs['py'], *_ = \
+                    images[k]['padding']
+                aliasAttribs['a'] = attribs['n']
+                sheet.append(et.Element('img', attrib={
+                    k: str(v) for k, v in aliasAttribs.items()
+                }))
+    writeIfChanged(
+        outFolder / 'spritesheet.xml',
+        et.tostring(root, pretty_print=True)
+    )
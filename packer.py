@@ -1,14 +1,39 @@
+from __future__ import annotations
+
 import argparse
+import hashlib
+import io
 import json
+import math
+import os
+import re
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, \
+    ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from fractions import Fraction
+from itertools import count, product
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
-from tempfile import TemporaryDirectory
-from typing import List, Dict
+from tempfile import TemporaryDirectory, gettempdir
+from time import perf_counter, sleep
+from typing import Callable, Iterable, List, Dict, Optional, Tuple
 
-import lxml.etree as et
-import numpy as np
-from PIL import Image
+from BinPacker.BinPacker import ENGINES, SORT_KEYS, BinPacker
+from BinPacker.LazyImport import lazyImport
+from BinPacker.Rectangle import Rectangle
+from exporters import EXPORTERS, getExporter, spriteEntries, \
+    writeIfChanged
 
-from BinPacker.BinPacker import BinPacker
+np = lazyImport('numpy')
+Image = lazyImport('PIL.Image')
 
 
 def positive_value(x) -> int:
@@ -18,9 +43,36 @@ def positive_value(x) -> int:
     return x
 
 
+def non_negative_seconds(x) -> float:
+    x = float(x)
+    if not x >= 0:
+        raise argparse.ArgumentTypeError('Value must not be negative')
+    return x
+
+
+def scale_list(x) -> List[Fraction]:
+    try:
+        scales = [Fraction(i) for i in x.split(',')]
+    except (ValueError, ZeroDivisionError):
+        raise argparse.ArgumentTypeError('Invalid list of scales') from None
+    if not all(i > 0 for i in scales):
+        raise argparse.ArgumentTypeError('Scales must be positive numbers')
+    return scales
+
+
+class ImageError(Exception):
+    pass
+
+
 homePath = Path('./')
 
-argParser = argparse.ArgumentParser("Generate spritesheet")
+HEURISTICS = ['area', 'shortSide', 'longSide', 'bottomLeft', 'contactPoint']
+
+argParser = argparse.ArgumentParser(
+    "Generate spritesheet",
+    epilog="'packer serve' runs jobs sent by 'packer submit [args]' with "
+           "warm workers, see their --help"
+)
 argParser.add_argument('format', nargs='?', default='png', type=str,
                        help="Format of files from which spritesheet will be "
                             "generated")
@@ -37,178 +89,1804 @@ argParser.add_argument('-d', '--dir', default='./',
 argParser.add_argument('-o', '--outfolder', default='out',
                        type=str, help="Name of output folder")
 argParser.add_argument('-f', '--outFormat', default='png',
-                       type=str, help="Format used to export spritesheets")
+                       type=str, help="Format used to export spritesheets, "
+                                      "comma separated list to save each "
+                                      "spritesheet in several formats (the "
+                                      "first one is used in exported data). "
+                                      "'raw' and 'pma' save uncompressed "
+                                      "RGBA, 'pma' with premultiplied alpha")
+argParser.add_argument('-e', '--profile', default='default',
+                       choices=['default', 'fast', 'balanced', 'smallest'],
+                       help="Encoder settings used to save spritesheets")
 argParser.add_argument('-x', '--xml', default=False, action='store_true',
                        help="Export spritesheet as xml, json otherwise")
+argParser.add_argument('--binary', default=False, action='store_true',
+                       help="Export spritesheet in compact binary format "
+                            "with an index for name lookup")
+argParser.add_argument('--exporter', default=None, type=str,
+                       help="Exporter of spritesheet data, one of "
+                            f"{', '.join(EXPORTERS)} or module:function of "
+                            "a plugin")
+argParser.add_argument('--scales', default='1', type=scale_list,
+                       help="Comma separated list of scales, spritesheets "
+                            "and data of each scale other than 1 are saved "
+                            "to their own subfolder, e.g. 0.5x")
+argParser.add_argument('-r', '--rotate', default=False, action='store_true',
+                       help="Allow rotating images by 90 degrees clockwise, "
+                            "rotated images are marked in exported data")
+argParser.add_argument('-g', '--pages', default=False, action='store_true',
+                       help="Make every spritesheet the same size, max width "
+                            "and height rounded down to a power of two, so "
+                            "they can be stored in one texture array")
+argParser.add_argument('--engine', default='maxRects', choices=list(ENGINES),
+                       help="Packing algorithm, skyline is faster but "
+                            "leaves more empty space")
+argParser.add_argument('--heuristic', default='area', choices=HEURISTICS,
+                       help="Rule used to choose where an image is placed")
+argParser.add_argument('--sort', default=None, choices=list(SORT_KEYS),
+                       help="Order in which images are packed, largest "
+                            "first")
+argParser.add_argument('--seed', default=None, type=int,
+                       help="Pack images shuffled with given seed instead "
+                            "of sorted")
+argParser.add_argument('-O', '--optimize', default=None,
+                       type=non_negative_seconds,
+                       help="Seconds spent packing with other orders, "
+                            "heuristics and sizes of spritesheets in --jobs "
+                            "processes, the layout with the smallest area is "
+                            "kept and its settings are saved to packing.json. "
+                            "Candidates running at the deadline are "
+                            "finished, so it may take up to one packing "
+                            "longer")
+argParser.add_argument('-u', '--dedupe', default=False, action='store_true',
+                       help="Pack identical images once, the others are "
+                            "exported as aliases of the packed one")
+argParser.add_argument('-s', '--stats', default=None, type=str,
+                       help="Save time spent in each stage and packer "
+                            "statistics to given json file")
+argParser.add_argument('-w', '--watch', default=False, action='store_true',
+                       help="Keep running and repack when images change")
+argParser.add_argument('--interval', default=0.5, type=float,
+                       help="Seconds between checks for changes in watch "
+                            "mode")
+argParser.add_argument('--debounce', default=1.0, type=float,
+                       help="Seconds without changes before repacking in "
+                            "watch mode")
+argParser.add_argument('-j', '--jobs', default=1, type=positive_value,
+                       help="Number of processes used to prepare images and "
+                            "of threads used to save spritesheets")
+argParser.add_argument('-m', '--memory-budget', default=None,
+                       type=positive_value,
+                       help="Memory (in MB) for trimmed images, the rest is "
+                            "kept in memory-mapped files. Defaults to half of "
+                            "the available memory")
+argParser.add_argument('-M', '--max-memory', default=None,
+                       type=positive_value,
+                       help="Lower peak memory by streaming: only sizes "
+                            "are read first, then images of each spritesheet "
+                            "are decoded, saved and released in turn. Given "
+                            "MB must fit one spritesheet and limits how many "
+                            "are saved at once, the interpreter, layout and "
+                            "image metadata are not counted")
+argParser.add_argument('-t', '--tag-dirs', default=False,
+                       action='store_true',
+                       help="Include images from subdirectories, each "
+                            "subdirectory is packed into its own "
+                            "spritesheets")
+argParser.add_argument('--tag-pattern', default=None, type=str,
+                       help="Regular expression matched against image "
+                            "names, images with the same match (or first "
+                            "group) are packed into their own spritesheets")
+argParser.add_argument('-c', '--cache', default=None, type=str,
+                       help="Folder with cached images and layout, only "
+                            "changed images and spritesheets are rebuilt")
+
+DEFAULT_SOCKET = str(Path(gettempdir()) / 'packer.sock')
+
+serveParser = argparse.ArgumentParser(
+    "packer serve", description="Run pack jobs sent by 'packer submit' "
+                                "with warm workers and cached images"
+)
+serveParser.add_argument('--socket', default=DEFAULT_SOCKET, type=str,
+                         help="Unix socket to listen on")
+serveParser.add_argument('--port', default=None, type=positive_value,
+                         help="Listen on given localhost port instead of "
+                              "the socket")
+serveParser.add_argument('-j', '--jobs', default=os.cpu_count() or 1,
+                         type=positive_value,
+                         help="Number of jobs run at once and of threads "
+                              "decoding images")
+serveParser.add_argument('--cache-size', default=512, type=positive_value,
+                         help="Memory (in MB) for trimmed images kept "
+                              "between jobs")
+serveParser.add_argument('--root', default='.', type=str,
+                         help="Folder outside of which jobs may not read "
+                              "or write files")
+
+submitParser = argparse.ArgumentParser(
+    "packer submit", allow_abbrev=False,
+    description="Send a pack job to 'packer serve' and wait for it to "
+                "finish. Other arguments are those of packer itself."
+)
+submitParser.add_argument('--socket', default=DEFAULT_SOCKET, type=str)
+submitParser.add_argument('--port', default=None, type=positive_value)
+submitParser.add_argument('--files', default=None, type=str,
+                          help="File with paths of images to pack, one per "
+                               "line, instead of images found in --dir")
+
+ENCODER_PROFILES = {
+    'default': {
+        'webp': {'lossless': True, 'quality': 100, 'method': 6}
+    },
+    'fast': {
+        'png': {'compress_level': 1},
+        'webp': {'lossless': True, 'quality': 0, 'method': 0}
+    },
+    'balanced': {
+        'png': {'compress_level': 6},
+        'webp': {'lossless': True, 'quality': 50, 'method': 3}
+    },
+    'smallest': {
+        'png': {'compress_level': 9, 'optimize': True},
+        'webp': {'lossless': True, 'quality': 100, 'method': 6}
+    }
+}
+
+
+# Raw sheets start with magic, version, flags, width and height, RGBA rows
+# follow right after the header
+RAW_HEADER = struct.Struct('<4sHHII')
+RAW_MAGIC = b'SPRT'
+RAW_VERSION = 1
+RAW_PREMULTIPLIED = 1
+RAW_FORMATS = {'raw': 0, 'pma': RAW_PREMULTIPLIED}
+
+
+class Stats:
+    def __init__(self, hook: Callable = None):
+        self.hook = hook
+        self.stages: Dict[str, float] = {}
+        self.events: Dict[str, Dict[str, int]] = {}
+
+    def __call__(self, event: str, **info) -> None:
+        if event == 'stage':
+            self.stages[info['name']] = \
+                self.stages.get(info['name'], 0) + info['time']
+        else:
+            counters = self.events.setdefault(event, {'calls': 0})
+            counters['calls'] += 1
+            for key, value in info.items():
+                value = int(value)
+                counters[key] = counters.get(key, 0) + value
+                maxKey = f'{key}Max'
+                counters[maxKey] = max(counters.get(maxKey, value), value)
+
+        if self.hook:
+            self.hook(event, **info)
+
+    def toDict(self) -> Dict:
+        return {
+            'stages': self.stages,
+            'total': sum(self.stages.values()),
+            'packer': self.events
+        }
+
+
+@contextmanager
+def stage(hook: Optional[Callable], name: str):
+    if hook is None:
+        yield
+        return
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        hook('stage', name=name, time=perf_counter() - start)
+
+
+def availableMemory() -> Optional[int]:
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class SpriteStore:
+    def __init__(self, budget: Optional[int] = None):
+        self.budget = budget
+        self.used = 0
+        self.spillDir: Optional[TemporaryDirectory] = None
+        self.sprites: Dict[str, np.ndarray] = {}
+        self.shared: Dict[str, SharedMemory] = {}
+        self.spilled = 0
+        self.spillPaths: Dict[str, Path] = {}
+
+    def fits(self, size: int) -> bool:
+        return self.budget is None or self.used + size <= self.budget
+
+    def spill(self, name: str, pixels: np.ndarray) -> np.ndarray:
+        if self.spillDir is None:
+            self.spillDir = TemporaryDirectory()
+
+        path = Path(self.spillDir.name, f'{self.spilled}.npy')
+        self.spilled += 1
+        self.spillPaths[name] = path
+        mapped = np.lib.format.open_memmap(
+            path, mode='w+', dtype=pixels.dtype, shape=pixels.shape
+        )
+        mapped[...] = pixels
+        mapped.flush()
+        del mapped
+        return np.load(path, mmap_mode='r')
+
+    def add(self, name: str, pixels: np.ndarray) -> None:
+        if self.fits(pixels.nbytes):
+            self.used += pixels.nbytes
+        else:
+            pixels = self.spill(name, pixels)
+        self.sprites[name] = pixels
+
+    def adopt(self, name: str, sharedName: str, shape: Tuple) -> None:
+        shm = SharedMemory(sharedName)
+        pixels = np.ndarray(shape, np.uint8, buffer=shm.buf)
+
+        if self.fits(pixels.nbytes):
+            self.used += pixels.nbytes
+            self.shared[name] = shm
+            self.sprites[name] = pixels
+        else:
+            self.sprites[name] = self.spill(name, pixels)
+            del pixels
+            shm.close()
+            shm.unlink()
+
+    def discard(self, name: str) -> None:
+        pixels = self.sprites.pop(name, None)
+        if pixels is not None and not isinstance(pixels, np.memmap):
+            self.used -= pixels.nbytes
+        del pixels
+
+        path = self.spillPaths.pop(name, None)
+        if path is not None:
+            try:
+                path.unlink(missing_ok=True)
+            except OSError:
+                # Still mapped elsewhere (Windows), removed by close()
+                pass
+
+        shm = self.shared.pop(name, None)
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.sprites[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.sprites
+
+    def close(self) -> None:
+        self.sprites.clear()
+        self.spillPaths.clear()
+        self.used = 0
+        for shm in self.shared.values():
+            shm.close()
+            shm.unlink()
+        self.shared.clear()
+        if self.spillDir is not None:
+            self.spillDir.cleanup()
+            self.spillDir = None
+
+
+def digest(content: bytes) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+class BuildCache:
+    # Without a path nothing is persisted, only layout and sheets are tracked
+    def __init__(self, path: Optional[Path], settings: Dict):
+        self.path = Path(path) if path else None
+        if self.path:
+            self.spritePath = self.path / 'sprites'
+            self.spritePath.mkdir(parents=True, exist_ok=True)
+        self.settings = settings
+        self.keys: Dict[str, str] = {}
+
+        self.index = self.load('index.json')
+        self.layout = self.load('layout.json')
+        self.sheets = self.load('sheets.json')
+        if self.layout.get('settings') != settings:
+            self.layout = {'settings': settings}
+
+    def load(self, name: str) -> Dict:
+        if self.path is None:
+            return {}
+        try:
+            return json.loads((self.path / name).read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def key(self, name: str, file: Path) -> str:
+        self.keys[name] = digest(Path(file).read_bytes())
+        return self.keys[name]
+
+    def getData(self, key: str) -> Optional[Dict]:
+        if key not in self.index:
+            return None
+        data = dict(self.index[key])
+        data['padding'] = tuple(data['padding'])
+        return data
+
+    def getSprite(self, key: str) -> Optional[Tuple[Dict, np.ndarray]]:
+        if self.path is None or key not in self.index:
+            return None
+        try:
+            pixels = np.load(self.spritePath / f'{key}.npy')
+        except (OSError, ValueError):
+            return None
+        return self.getData(key), pixels
+
+    def putData(self, key: str, data: Dict) -> None:
+        if self.path is not None:
+            self.index[key] = data
+
+    def putSprite(self, key: str, data: Dict, pixels: np.ndarray) -> None:
+        if self.path is None:
+            return
+        np.save(self.spritePath / f'{key}.npy', pixels)
+        self.index[key] = data
+
+    def layoutKey(self, sizes: List[Dict]) -> str:
+        return digest(json.dumps([
+            (i['data']['name'], i['width'], i['height']) for i in sizes
+        ]).encode())
+
+    def getLayout(self, sizes: List[Dict]) -> Optional[List[Dict]]:
+        if self.layout.get('key') != self.layoutKey(sizes):
+            return None
+        return [
+            {
+                'size': tuple(i['size']),
+                'rects': {
+                    name: {
+                        'pos': tuple(rect['pos']),
+                        'size': tuple(rect['size']),
+                        'rotated': rect.get('rotated', False),
+                        'data': rect['data']
+                    } for name, rect in i['rects'].items()
+                }
+            } for i in self.layout['data']
+        ]
+
+    def putLayout(self, sizes: List[Dict], data: List[Dict]) -> None:
+        self.layout['key'] = self.layoutKey(sizes)
+        self.layout['data'] = data
+
+    def sheetKey(self, sheetData: Dict, profile: str = 'default') -> str:
+        # Encoder profile is part of the key, the layout doesn't depend on it
+        return digest(json.dumps([
+            profile,
+            sheetData['size'],
+            [(self.keys.get(name), rect['pos'], rect.get('rotated', False))
+             for name, rect in sheetData['rects'].items()]
+        ]).encode())
+
+    def sheetChanged(
+            self,
+            path: Path,
+            sheetData: Dict,
+            profile: str = 'default'
+    ) -> bool:
+        key = self.sheetKey(sheetData, profile)
+        name = str(path.resolve())
+        if self.sheets.get(name) == key and path.exists():
+            return False
+        self.sheets[name] = key
+        return True
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+
+        used = set(self.keys.values())
+        for key in set(self.index) - used:
+            del self.index[key]
+            (self.spritePath / f'{key}.npy').unlink(missing_ok=True)
+
+        writeIfChanged(self.path / 'index.json',
+                       json.dumps(self.index).encode())
+        writeIfChanged(self.path / 'layout.json',
+                       json.dumps(self.layout).encode())
+        writeIfChanged(self.path / 'sheets.json',
+                       json.dumps(self.sheets).encode())
+
+
+def spriteName(file: Path, home: Path = None) -> str:
+    # Images from subdirectories keep their relative path in the name
+    try:
+        return Path(file).relative_to(home or homePath) \
+            .with_suffix('').as_posix()
+    except ValueError:
+        return Path(file).stem
+
+
+def findFiles(args: argparse.Namespace, home: Path = None) -> List[Path]:
+    home = home or homePath
+    if not args.tag_dirs:
+        return list(home.glob(f'*.{args.format}'))
+
+    skip = [Path(i).resolve() for i in (args.outfolder, args.cache) if i]
+    return [
+        i for i in home.rglob(f'*.{args.format}')
+        if not any(i.is_relative_to(j) for j in skip)
+    ]
+
+
+def getTag(name: str, args: argparse.Namespace) -> str:
+    if args.tag_pattern:
+        match = re.search(args.tag_pattern, name)
+        if match is None:
+            return ''
+        return match.group(1) if match.groups() else match.group(0)
+    if args.tag_dirs:
+        return name.rpartition('/')[0]
+    return ''
+
+
+def trimPixels(pixels: np.ndarray) -> Tuple[np.ndarray, Tuple]:
+    height, width = pixels.shape[:2]
+    alpha = pixels[..., 3]
+
+    if alpha.min() == 255:
+        return pixels, (0, 0, width, height)
+
+    rows = alpha.any(axis=1)
+    if not rows[rows.argmax()]:
+        # Fully transparent image is kept as a single transparent pixel
+        return np.zeros((1, 1, 4), np.uint8), (0, 0, 1, 1)
+
+    top = int(rows.argmax())
+    bottom = height - int(rows[::-1].argmax())
+    cols = alpha[top:bottom].any(axis=0)
+    left = int(cols.argmax())
+    right = width - int(cols[::-1].argmax())
+
+    pixels = pixels[top:bottom, left:right].copy()
+    pixels[pixels[..., 3] == 0, :3] = 0
+    return pixels, (left, top, right, bottom)
+
+
+def hasAlpha(image: Image.Image) -> bool:
+    return 'transparency' in image.info or \
+        bool({'A', 'a'} & set(image.getbands()))
+
+
+def cleanSprite(image) -> Tuple[Dict, np.ndarray]:
+    # Image is either a PIL image or an RGBA array
+    if isinstance(image, np.ndarray):
+        if image.dtype != np.uint8 or image.ndim != 3 or image.shape[2] != 4:
+            raise ValueError('array must be RGBA of uint8')
+        shape = (image.shape[1], image.shape[0])
+        pixels, padding = trimPixels(image)
+    elif image.mode == 'RGBA':
+        shape = image.size
+        pixels, padding = trimPixels(np.asarray(image))
+    elif hasAlpha(image):
+        shape = image.size
+        pixels, padding = trimPixels(np.asarray(image.convert('RGBA')))
+    else:
+        shape = image.size
+        pixels = np.asarray(image.convert('RGBA'))
+        padding = (0, 0, shape[0], shape[1])
+
+    return {
+        'width': shape[0],
+        'height': shape[1],
+        '_width': pixels.shape[1],
+        '_height': pixels.shape[0],
+        'padding': padding
+    }, pixels
+
+
+def cleanImage(file: Path) -> Tuple[Dict, np.ndarray]:
+    with Image.open(file) as imageFile:
+        return cleanSprite(imageFile)
+
+
+def readImages(files: List[Path]) -> Iterable[Tuple[str, object]]:
+    # Opened one at a time, each is closed once the next one is asked for
+    for file in files:
+        try:
+            imageFile = Image.open(file)
+        except Exception as e:
+            raise ImageError(f"Cannot process image '{file}': {e}") from None
+        with imageFile:
+            yield spriteName(file), imageFile
+
+
+def _cleanImage(file: Path, shared: bool = False) -> Tuple[Dict, object]:
+    try:
+        data, pixels = cleanImage(file)
+    except Exception as e:
+        raise ImageError(f"Cannot process image '{file}': {e}") from None
+
+    if not shared:
+        return data, pixels
+
+    shm = SharedMemory(create=True, size=max(pixels.nbytes, 1))
+    np.ndarray(pixels.shape, np.uint8, buffer=shm.buf)[...] = pixels
+    shm.close()
+    return data, (shm.name, pixels.shape)
 
 
-def cleanImages(files: List[Path], tempPath: Path) -> Dict[str, Dict]:
+def _cleanShared(file: Path) -> object:
+    # Errors are returned instead of raised, so blocks of images which were
+    # processed fine can still be released
+    try:
+        return _cleanImage(file, True)
+    except ImageError as e:
+        return e
+
+
+def releaseShared(sharedName: str) -> None:
+    shm = SharedMemory(sharedName)
+    shm.close()
+    shm.unlink()
+
+
+def cleanImages(
+        files: List[Path],
+        store: SpriteStore,
+        jobs: int = 1,
+        cache: BuildCache = None
+) -> Dict[str, Dict]:
     outData = {}
 
+    if cache is not None:
+        pending = []
+        for file in files:
+            name = spriteName(file)
+            cached = cache.getSprite(cache.key(name, file))
+            if cached is None:
+                pending.append(file)
+            else:
+                outData[name], pixels = cached
+                store.add(name, pixels)
+    else:
+        pending = files
+
+    if jobs > 1 and len(pending) > 1:
+        # Workers hand the pixels over in shared memory blocks, which are
+        # tracked by the resource tracker of this process from now on.
+        resource_tracker.ensure_running()
+        with ProcessPoolExecutor(min(jobs, len(pending))) as pool:
+            results = list(pool.map(
+                _cleanShared, pending,
+                chunksize=max(1, len(pending) // (jobs * 4))
+            ))
+
+        errors = [i for i in results if isinstance(i, ImageError)]
+        if errors:
+            for i in results:
+                if not isinstance(i, ImageError):
+                    releaseShared(i[1][0])
+            raise errors[0]
+
+        for file, (data, (sharedName, shape)) in zip(pending, results):
+            name = spriteName(file)
+            store.adopt(name, sharedName, shape)
+            outData[name] = data
+    else:
+        for file in pending:
+            name = spriteName(file)
+            outData[name], pixels = _cleanImage(file)
+            store.add(name, pixels)
+
+    if cache is not None:
+        for file in pending:
+            name = spriteName(file)
+            cache.putSprite(cache.keys[name], outData[name], store[name])
+
+    return {i: outData[i] for i in map(spriteName, files)}
+
+
+def spriteKey(pixels: np.ndarray) -> str:
+    return digest(str(pixels.shape).encode() + pixels.tobytes())
+
+
+def measureImage(file: Path, hashed: bool = False) -> Dict:
+    try:
+        with Image.open(file) as imageFile:
+            # Without alpha nothing is trimmed, the header is enough
+            if not hashed and not hasAlpha(imageFile):
+                width, height = imageFile.size
+                return {
+                    'width': width,
+                    'height': height,
+                    '_width': width,
+                    '_height': height,
+                    'padding': (0, 0, width, height)
+                }
+    except Exception as e:
+        raise ImageError(f"Cannot process image '{file}': {e}") from None
+
+    data, pixels = _cleanImage(file)
+    if hashed:
+        data['hash'] = spriteKey(pixels)
+    return data
+
+
+def measureImages(
+        files: List[Path],
+        jobs: int = 1,
+        cache: BuildCache = None,
+        hashed: bool = False
+) -> Dict[str, Dict]:
+    outData = {}
+    pending = []
     for file in files:
-        name = Path(file).stem
-        imageFile = Image.open(file).convert('RGBA')
-        r, g, b, a = imageFile.split()
-        shape = imageFile.size
-        imageFile.close()
-
-        mask = np.array(a) == 0
-        r = Image.fromarray(
-            np.ma.array(r, mask=mask).filled(0),
-            'L'
-        )
-        g = Image.fromarray(
-            np.ma.array(g, mask=mask).filled(0),
-            'L'
-        )
-        b = Image.fromarray(
-            np.ma.array(b, mask=mask).filled(0),
-            'L'
+        name = spriteName(file)
+        data = cache.getData(cache.key(name, file)) if cache else None
+        if data is None or hashed and 'hash' not in data:
+            pending.append(file)
+        else:
+            outData[name] = data
+
+    if jobs > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(min(jobs, len(pending))) as pool:
+            results = pool.map(
+                measureImage, pending, [hashed] * len(pending),
+                chunksize=max(1, len(pending) // (jobs * 4))
+            )
+            for file, data in zip(pending, results):
+                outData[spriteName(file)] = data
+    else:
+        for file in pending:
+            outData[spriteName(file)] = measureImage(file, hashed)
+
+    if cache is not None:
+        for file in pending:
+            name = spriteName(file)
+            cache.putData(cache.keys[name], outData[name])
+
+    return {i: outData[i] for i in map(spriteName, files)}
+
+
+class FileSprites:
+    # Sprites are decoded from their files on access and never kept
+    def __init__(self, files: List[Path]):
+        self.files = {spriteName(file): Path(file) for file in files}
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return _cleanImage(self.files[name])[1]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.files
+
+
+def findDuplicates(
+        images: Dict[str, Dict],
+        store: SpriteStore,
+        tags: Dict[str, str] = None
+) -> Dict[str, List[str]]:
+    aliases: Dict[str, List[str]] = {}
+    seen: Dict[Tuple[str, str], str] = {}
+    for name in images:
+        # Images are only aliased within their own tag group
+        key = (
+            (tags or {}).get(name, ''),
+            images[name].get('hash') or spriteKey(store[name])
         )
+        if key in seen:
+            aliases[seen[key]].append(name)
+        else:
+            seen[key] = name
+            aliases[name] = []
 
-        path = Path(tempPath, f'{name}.npy')
-        img = Image.merge('RGBA', [r, g, b, a])
-        padding = img.getbbox()
-        img = img.crop(img.getbbox())
-        newSize = img.size
-        np.save(path, img)
-
-        del img
-        outData[name] = {
-            'path': path,
-            'width': shape[0],
-            'height': shape[1],
-            '_width': newSize[0],
-            '_height': newSize[1],
-            'padding': padding
-        }
+    return {k: v for k, v in aliases.items() if v}
 
-    return outData
 
+def paste(sheet: np.ndarray, pixels: np.ndarray, pos: Tuple) -> None:
+    x, y = pos
+    h = min(pixels.shape[0], sheet.shape[0] - y)
+    w = min(pixels.shape[1], sheet.shape[1] - x)
+    if w > 0 and h > 0:
+        sheet[y:y + h, x:x + w] = pixels[:h, :w]
 
-def getName(name: str, repNames: Dict[str, str]) -> str:
-    if repNames is None or name not in repNames:
-        return name
-    return repNames[name]
 
+def composite(sheetData: Dict, store: SpriteStore) -> np.ndarray:
+    width, height = sheetData['size']
+    sheet = np.zeros((height, width, 4), np.uint8)
 
-def toJson(
-        data: list,
-        images,
-        outFolder: Path,
-        outFormat: str,
-        repNames: Dict[str, str]
-) -> None:
-    out = 0
-    spritesheet = {}
-    for i in range(len(data)):
-        t = {}
-        for j in data[i]['rects'].keys():
-            name = getName(j, repNames)
-            t[name] = {}
-            t[name]['x'], t[j]['y'] = data[i]['rects'][j]['pos']
-            t[name]['width'], t[j]['height'] = data[i]['rects'][j]['size']
-            t[name]['pad_x'], t[j]['pad_y'], *_ = images[j]['padding']
-        spritesheet[f'{out}.{outFormat}'] = t.copy()
-        out += 1
-
-    (outFolder / 'spritesheet.json').write_text(
-        json.dumps(spritesheet, indent=4)
-    )
+    for name, rect in sheetData['rects'].items():
+        pixels = store[name]
+        if rect.get('rotated'):
+            pixels = np.rot90(pixels, -1)
+        paste(sheet, pixels, rect['pos'])
 
+    return sheet
 
-def toXml(
-        data: list,
-        images,
-        outFolder: Path,
-        outFormat: str,
-        repNames: Dict[str, str]
-) -> None:
-    out = 0
-    root = et.Element('spritesheets')
-    for i in range(len(data)):
-        sheet: et.Element = et.Element('sheet', attrib={
-            'name': f'{out}.{outFormat}'
+
+def encoderOptions(outFormat: str, profile: str = 'default') -> Dict:
+    return ENCODER_PROFILES[profile].get(outFormat.lower(), {})
+
+
+class ScaledSprites:
+    # Sprites of the store resized on access to sizes of given images
+    def __init__(self, store: SpriteStore, images: Dict[str, Dict],
+                 scale: Fraction):
+        self.store = store
+        self.images = images
+        self.scale = scale
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        pixels = self.store[name]
+        if self.scale == 1:
+            return pixels
+
+        size = (self.images[name]['_width'], self.images[name]['_height'])
+        # Resized with premultiplied alpha, so transparent pixels don't
+        # bleed their color into the edges
+        image = Image.fromarray(np.ascontiguousarray(pixels), 'RGBA')
+        image = image.convert('RGBa').resize(size, Image.LANCZOS)
+        return np.asarray(image.convert('RGBA'))
+
+
+def scaleGrid(scales: List[Fraction]) -> int:
+    # Packing with sizes, padding and border snapped to multiples of the
+    # grid keeps every position an integer at each scale
+    return math.lcm(*(i.denominator for i in scales))
+
+
+def snap(value: int, grid: int) -> int:
+    return -(-value // grid) * grid
+
+
+def scaleImages(images: Dict[str, Dict], scale: Fraction) -> Dict[str, Dict]:
+    if scale == 1:
+        return images
+
+    def scaled(value):
+        return max(1, round(value * scale))
+
+    return {
+        name: dict(
+            info,
+            width=scaled(info['width']),
+            height=scaled(info['height']),
+            _width=scaled(info['_width']),
+            _height=scaled(info['_height']),
+            padding=tuple(round(i * scale) for i in info['padding'])
+        ) for name, info in images.items()
+    }
+
+
+def scaleLayout(data: List[Dict], images: Dict[str, Dict],
+                scale: Fraction) -> List[Dict]:
+    # Rects are packed snapped to the grid, their sizes are taken from
+    # (scaled) images instead
+    scaledData = []
+    for sheetData in data:
+        width, height = sheetData['size']
+        rects = {}
+        for name, rect in sheetData['rects'].items():
+            size = (images[name]['_width'], images[name]['_height'])
+            if rect.get('rotated'):
+                size = size[::-1]
+            x, y = rect['pos']
+            rects[name] = dict(
+                rect, pos=(int(x * scale), int(y * scale)), size=size
+            )
+
+        scaledData.append({
+            'size': (math.ceil(width * scale), math.ceil(height * scale)),
+            'rects': rects
         })
-        root.append(sheet)
-        out += 1
-        for j in data[i]['rects'].keys():
-            attribs = {}
-            attribs['n'] = getName(j, repNames)
-            attribs['x'], attribs['y'] = data[i]['rects'][j]['pos']
-            attribs['w'], attribs['h'] = data[i]['rects'][j]['size']
-            attribs['px'], attribs['py'], *_ = images[j]['padding']
-
-            elem = et.Element('img', attrib={
-                k: str(v) for k, v in attribs.items()
-            })
-            sheet.append(elem)
-    (outFolder / 'spritesheet.xml').write_bytes(
-        et.tostring(root, pretty_print=True)
-    )
+    return scaledData
+
+
+def scaleFolder(outFolder: Path, scale: Fraction) -> Path:
+    return outFolder if scale == 1 else outFolder / f'{float(scale):g}x'
+
+
+def premultiply(pixels: np.ndarray) -> np.ndarray:
+    alpha = pixels[..., 3:].astype(np.uint16)
+    out = pixels.copy()
+    out[..., :3] = (pixels[..., :3] * alpha + 127) // 255
+    return out
+
+
+def writeRaw(pixels: np.ndarray, file, flags: int = 0) -> None:
+    if flags & RAW_PREMULTIPLIED:
+        pixels = premultiply(pixels)
+
+    height, width = pixels.shape[:2]
+    file.write(RAW_HEADER.pack(RAW_MAGIC, RAW_VERSION, flags, width, height))
+    file.write(np.ascontiguousarray(pixels).data)
+
+
+def saveRaw(pixels: np.ndarray, path: Path, flags: int = 0) -> None:
+    with open(path, 'wb') as file:
+        writeRaw(pixels, file, flags)
+
+
+def saveSheet(
+        sheetData: Dict,
+        store: SpriteStore,
+        paths: List[Path],
+        profile: str = 'default'
+) -> None:
+    pixels = composite(sheetData, store)
+    image = None
+    for path in paths:
+        outFormat = path.suffix[1:].lower()
+        if outFormat in RAW_FORMATS:
+            saveRaw(pixels, path, RAW_FORMATS[outFormat])
+            continue
+
+        if image is None:
+            image = Image.fromarray(pixels, 'RGBA')
+        image.save(str(path), **encoderOptions(outFormat, profile))
+
+
+def imageFormat(outFormat: str) -> str:
+    extensions = Image.registered_extensions()
+    if f'.{outFormat}' not in extensions:
+        raise ValueError(f"Unknown image format '{outFormat}'")
+    return extensions[f'.{outFormat}']
+
+
+class Spritesheets:
+    # Packed spritesheets of one scale, composited when accessed
+    def __init__(
+            self,
+            data: List[Dict],
+            images: Dict[str, Dict],
+            store: SpriteStore,
+            scale: Fraction = Fraction(1),
+            aliases: Dict[str, List[str]] = None,
+            repNames: Dict[str, str] = None,
+            outFormat: str = 'png'
+    ):
+        self.scale = scale
+        self.images = scaleImages(images, scale)
+        self.data = scaleLayout(data, self.images, scale)
+        self.sprites = ScaledSprites(store, self.images, scale)
+        self.aliases = aliases or {}
+        self.repNames = repNames
+        self.outFormat = outFormat
+
+    @property
+    def layout(self) -> Dict[str, Dict[str, Dict]]:
+        # Same content as spritesheet.json
+        return {
+            f'{out}.{self.outFormat}': {
+                name: entry for name, entry, _ in spriteEntries(
+                    sheetData, self.images, self.repNames, self.aliases
+                )
+            } for out, sheetData in enumerate(self.data)
+        }
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return composite(self.data[index], self.sprites)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def image(self, index: int) -> Image.Image:
+        return Image.fromarray(self[index], 'RGBA')
+
+    def encode(
+            self,
+            index: int,
+            outFormat: str = None,
+            profile: str = 'default'
+    ) -> bytes:
+        outFormat = (outFormat or self.outFormat).lower()
+        buffer = io.BytesIO()
+        if outFormat in RAW_FORMATS:
+            writeRaw(self[index], buffer, RAW_FORMATS[outFormat])
+        else:
+            self.image(index).save(
+                buffer, imageFormat(outFormat),
+                **encoderOptions(outFormat, profile)
+            )
+        return buffer.getvalue()
+
+    def encodeAll(
+            self,
+            outFormat: str = None,
+            profile: str = 'default'
+    ) -> List[bytes]:
+        return [self.encode(i, outFormat, profile) for i in range(len(self))]
+
+
+def exporterName(args: argparse.Namespace) -> str:
+    if args.exporter:
+        return args.exporter
+    if args.binary:
+        return 'binary'
+    return 'xml' if args.xml else 'json'
 
 
-def main(args: argparse.Namespace, repNames: Dict[str, str] = None) -> None:
+def cacheSettings(args: argparse.Namespace) -> Dict:
+    return {
+        'padding': args.padding,
+        'border': args.border,
+        'max_width': args.max_width,
+        'max_height': args.max_height,
+        'outFormat': args.outFormat,
+        'rotate': args.rotate,
+        'engine': args.engine,
+        'heuristic': args.heuristic,
+        'sort': args.sort,
+        'seed': args.seed,
+        'optimize': args.optimize,
+        'pages': args.pages,
+        'scales': [str(i) for i in args.scales],
+        'tagDirs': args.tag_dirs,
+        'tagPattern': args.tag_pattern
+    }
+
+
+def main(
+        args: argparse.Namespace,
+        repNames: Dict[str, str] = None,
+        hook: Callable = None
+) -> None:
     # chdir(Path(args.dir).resolve())
     global homePath
     homePath = Path(args.dir).resolve()
-    files = list(homePath.glob(f'*.{args.format}'))
+    files = findFiles(args)
 
-    if not len(files):
+    if not len(files) and not args.watch:
         return
 
-    tempDir = TemporaryDirectory()
+    budget = args.memory_budget * 2 ** 20 if args.memory_budget else None
+    if budget is None and availableMemory():
+        budget = availableMemory() // 2
+    store = SpriteStore(budget)
+    stats = None
+    if args.stats:
+        stats = hook = Stats(hook)
 
-    images = cleanImages(files, tempDir.name)
+    try:
+        if args.watch:
+            watch(args, store, repNames, hook)
+        else:
+            process(args, files, store, repNames, hook)
+    finally:
+        store.close()
+
+    if stats:
+        Path(args.stats).write_text(json.dumps(stats.toDict(), indent=4))
+
+
+def process(
+        args: argparse.Namespace,
+        files: List[Path],
+        store: SpriteStore,
+        repNames: Dict[str, str] = None,
+        hook: Callable = None
+) -> None:
+    cache = None
+    if args.cache:
+        cache = BuildCache(args.cache, cacheSettings(args))
+
+    if cache is None and args.jobs == 1 and not args.max_memory:
+        # Same path as pack(), only reading the files and writing the output
+        scaled = packImages(
+            args, readImages(files), store, repNames, hook,
+            Path(args.outfolder)
+        )
+        writeSheets(args, scaled, hook=hook)
+        return
+
+    if args.max_memory:
+        # First pass reads only sizes and trim boxes, sprites are decoded
+        # again when their spritesheet is saved
+        with stage(hook, 'measure'):
+            images = measureImages(files, args.jobs, cache, args.dedupe)
+        store = FileSprites(files)
+    else:
+        with stage(hook, 'clean'):
+            images = cleanImages(files, store, args.jobs, cache)
+
+    build(args, images, store, cache, repNames, hook)
+
+
+def scan(args: argparse.Namespace) -> Dict[Path, Tuple[int, int]]:
+    states = {}
+    for file in findFiles(args):
+        try:
+            stat = file.stat()
+        except OSError:
+            continue
+        states[file] = (stat.st_mtime_ns, stat.st_size)
+    return states
+
+
+def watch(
+        args: argparse.Namespace,
+        store: SpriteStore,
+        repNames: Dict[str, str] = None,
+        hook: Callable = None
+) -> None:
+    cache = BuildCache(args.cache, cacheSettings(args))
+    packers: Dict[str, BinPacker] = {}
+    images: Dict[str, Dict] = {}
+    states: Dict[Path, Tuple[int, int]] = {}
+    # Let the caller release shared memory when stopped by SIGTERM
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    try:
+        while True:
+            current = scan(args)
+            if current == states:
+                sleep(args.interval)
+                continue
+
+            # Wait until files stop changing, so a batch export triggers
+            # a single rebuild
+            changedAt = perf_counter()
+            while perf_counter() - changedAt < args.debounce:
+                sleep(args.interval)
+                latest = scan(args)
+                if latest != current:
+                    current = latest
+                    changedAt = perf_counter()
+
+            changed = [i for i in current if states.get(i) != current[i]]
+            for file in list(states):
+                if file not in current or file in changed:
+                    name = spriteName(file)
+                    images.pop(name, None)
+                    store.discard(name)
+                    cache.keys.pop(name, None)
+
+            with stage(hook, 'clean'):
+                images.update(cleanChanged(changed, store, args.jobs, cache))
+            names = [spriteName(i) for i in current]
+            images = {i: images[i] for i in names if i in images}
+            states = current
+
+            if images:
+                build(args, images, store, cache, repNames, hook, packers)
+            print(f'Packed {len(images)} images '
+                  f'({len(changed)} changed, {len(current)} files)')
+    except KeyboardInterrupt:
+        pass
 
-    sizes = [
-        {
-            'width': images[i]['_width'],
-            'height': images[i]['_height'],
-            'data': {
-                'name': i
-            }
-        } for i in images
-    ]
 
+def cleanChanged(
+        files: List[Path],
+        store: SpriteStore,
+        jobs: int,
+        cache: BuildCache
+) -> Dict[str, Dict]:
+    try:
+        return cleanImages(files, store, jobs, cache)
+    except ImageError:
+        pass
+
+    # Some file is broken, skip it and report it without dropping the rest
+    images = {}
+    for file in files:
+        store.discard(spriteName(file))
+        try:
+            images.update(cleanImages([file], store, 1, cache))
+        except ImageError as e:
+            print(e, file=sys.stderr)
+    return images
+
+
+def sheetMemory(width: int, height: int) -> int:
+    # Sheet pixels and about as much again for the encoder
+    return width * height * 4 * 2
+
+
+def createPacker(args: argparse.Namespace, hook: Callable = None):
+    grid = scaleGrid(args.scales)
     packer = BinPacker(
         abs(args.max_width),
         abs(args.max_height),
-        abs(args.padding),
+        snap(abs(args.padding), grid),
         {
-            'border:': abs(args.border)
+            'border': snap(abs(args.border), grid),
+            'allowRotation': args.rotate,
+            'engine': args.engine,
+            'heuristic': args.heuristic,
+            'sortKey': args.sort,
+            'shuffleSeed': args.seed,
+            'fixedSize': args.pages
         }
     )
+    packer.hook = hook
+    return packer
+
+
+def syncPacker(packer: BinPacker, sizes: List[Dict]) -> None:
+    if not packer.bins:
+        packer.addList(sizes)
+        return
+
+    wanted = {i['data']['name']: i for i in sizes}
+    for name in list(packer.names):
+        if name not in wanted:
+            packer.remove(name)
+
+    added = []
+    for name, i in wanted.items():
+        if name in packer.names:
+            packer.update(name, i['width'], i['height'])
+        else:
+            added.append(Rectangle(i['width'], i['height'], data=i['data']))
+
+    for i in packer.sort(added):
+        packer.add(i)
+
+
+def packGroup(
+        args: argparse.Namespace,
+        sizes: List[Dict],
+        record: bool = False
+) -> Tuple[List[Dict], List[Tuple[str, Dict]]]:
+    # Hook events of a worker process are sent back to be replayed
+    events = []
+    packer = createPacker(args)
+    if record:
+        packer.hook = lambda event, **info: events.append((event, info))
+    return packer.addList(sizes).getData(), events
+
+
+def packGroups(
+        args: argparse.Namespace,
+        groups: Dict[str, List[Dict]],
+        hook: Callable = None
+) -> List[Dict]:
+    if args.jobs == 1 or len(groups) < 2:
+        data = []
+        for sizes in groups.values():
+            data.extend(createPacker(args, hook).addList(sizes).getData())
+        return data
+
+    with ProcessPoolExecutor(min(args.jobs, len(groups))) as pool:
+        # Largest groups are started first, results are merged in tag order
+        # so sheet numbers don't depend on which worker finishes first
+        futures = {
+            tag: pool.submit(packGroup, args, groups[tag], hook is not None)
+            for tag in sorted(groups, key=lambda i: -len(groups[i]))
+        }
+        data = []
+        for tag in groups:
+            sheets, events = futures[tag].result()
+            data.extend(sheets)
+            for event, info in events:
+                hook(event, **info)
+        return data
+
+
+def pageSizes(length: int, smallest: int) -> List[int]:
+    # Given length and a few smaller powers of two still fitting the largest
+    # image
+    sizes = [length]
+    size = 2 ** int(math.log2(length))
+    if size == length:
+        size //= 2
+    while size >= smallest and len(sizes) < 4:
+        sizes.append(size)
+        size //= 2
+    return sizes
 
-    data = packer.addList(sizes).getData()
-    outFolder = Path(args.outfolder)
-    if not outFolder.exists():
-        outFolder.mkdir(parents=True)
 
-    if args.xml:
-        toXml(data, images, outFolder, args.outFormat, repNames)
+def candidates(args: argparse.Namespace, groups: Dict[str, List[Dict]]):
+    # Settings given on the command line come first, so the search is never
+    # worse than a plain run
+    yield {}
+    if not groups:
+        return
+
+    sizes = [j for i in groups.values() for j in i]
+    pages = list(product(
+        pageSizes(abs(args.max_width), max(i['width'] for i in sizes)),
+        pageSizes(abs(args.max_height), max(i['height'] for i in sizes))
+    ))
+    for (width, height), sort, heuristic in product(
+            pages, SORT_KEYS, HEURISTICS
+    ):
+        yield {
+            'max_width': width,
+            'max_height': height,
+            'sort': sort,
+            'seed': None,
+            'heuristic': heuristic
+        }
+
+    for seed in count():
+        width, height = pages[seed % len(pages)]
+        yield {
+            'max_width': width,
+            'max_height': height,
+            'sort': None,
+            'seed': seed,
+            'heuristic': HEURISTICS[seed % len(HEURISTICS)]
+        }
+
+
+def candidateArgs(args: argparse.Namespace, overrides: Dict):
+    return argparse.Namespace(**{**vars(args), **overrides, 'jobs': 1})
+
+
+def layoutScore(data: List[Dict]) -> Tuple[int, int]:
+    return sum(w * h for w, h in (i['size'] for i in data)), len(data)
+
+
+_search = None
+
+
+def initSearch(args: argparse.Namespace, groups: Dict[str, List[Dict]]):
+    global _search
+    _search = args, groups
+
+
+def searchCandidate(overrides: Dict) -> Tuple[int, int]:
+    args, groups = _search
+    return layoutScore(packGroups(candidateArgs(args, overrides), groups))
+
+
+def optimize(
+        args: argparse.Namespace,
+        groups: Dict[str, List[Dict]],
+        outFolder: Optional[Path] = None
+) -> argparse.Namespace:
+    deadline = perf_counter() + args.optimize
+    found = enumerate(candidates(args, groups))
+    results = []
+
+    if args.jobs == 1:
+        for index, overrides in found:
+            score = layoutScore(
+                packGroups(candidateArgs(args, overrides), groups)
+            )
+            results.append((score, index, overrides))
+            if perf_counter() >= deadline:
+                break
     else:
-        toJson(data, images, outFolder, args.outFormat, repNames)
+        with ProcessPoolExecutor(
+                args.jobs, initializer=initSearch, initargs=(args, groups)
+        ) as pool:
+            pending = {}
+            for index, overrides in found:
+                if perf_counter() >= deadline:
+                    break
+                if len(pending) >= args.jobs:
+                    done, _ = wait(
+                        pending, max(0, deadline - perf_counter()),
+                        FIRST_COMPLETED
+                    )
+                    for i in done:
+                        results.append((i.result(), *pending.pop(i)))
+                pending[pool.submit(searchCandidate, overrides)] = \
+                    index, overrides
+
+            # Candidates already running are finished, the rest is dropped
+            for i in pending:
+                i.cancel()
+            for i, candidate in pending.items():
+                if not i.cancelled():
+                    results.append((i.result(), *candidate))
+
+    if not results:
+        # The budget ran out before anything was packed, the first candidate
+        # (settings as given) is always evaluated
+        results.append((
+            layoutScore(packGroups(candidateArgs(args, {}), groups)), 0, {}
+        ))
 
-    out = 0
+    # Ties go to the earlier candidate, so the result doesn't depend on the
+    # order in which workers finish
+    (area, sheets), _, overrides = min(results, key=lambda i: i[:2])
+    best = candidateArgs(args, overrides)
+    best.jobs = args.jobs
+    settings = {
+        'max_width': best.max_width,
+        'max_height': best.max_height,
+        'engine': best.engine,
+        'heuristic': best.heuristic,
+        'sort': best.sort,
+        'seed': best.seed
+    }
 
-    for i in data:
-        image = Image.new('RGBA', i['size'])
+    if outFolder is not None:
+        outFolder.mkdir(parents=True, exist_ok=True)
+        writeIfChanged(outFolder / 'packing.json', json.dumps({
+            'settings': settings,
+            'area': area,
+            'sheets': sheets,
+            'candidates': len(results)
+        }, indent=4).encode())
+        print(f'Best of {len(results)} candidates: {sheets} spritesheets, '
+              f'{area} pixels ({packingFlags(settings)})')
+    return best
 
-        for j in i['rects'].keys():
-            image.paste(Image.fromarray(
-                np.load(images[j]['path'])), i['rects'][j]['pos'])
 
-        if args.outFormat == 'webp':
-            image.save(str(outFolder / f'{out}.webp'),
-                       lossless=True, quality=100, method=6)
+def packingFlags(settings: Dict) -> str:
+    flags = [
+        f"-mw {settings['max_width']}",
+        f"-mh {settings['max_height']}",
+        f"--heuristic {settings['heuristic']}"
+    ]
+    if settings['engine'] != 'maxRects':
+        flags.append(f"--engine {settings['engine']}")
+    if settings['sort'] is not None:
+        flags.append(f"--sort {settings['sort']}")
+    if settings['seed'] is not None:
+        flags.append(f"--seed {settings['seed']}")
+    return ' '.join(flags)
+
+
+def layout(
+        args: argparse.Namespace,
+        images: Dict[str, Dict],
+        store: SpriteStore,
+        cache: Optional[BuildCache] = None,
+        hook: Callable = None,
+        packers: Dict[str, BinPacker] = None,
+        outFolder: Optional[Path] = None
+) -> Tuple[List[Dict], Dict[str, List[str]]]:
+    tags = {i: getTag(i, args) for i in images}
+    with stage(hook, 'dedupe'):
+        aliases = findDuplicates(images, store, tags) if args.dedupe else {}
+    duplicates = {j for i in aliases.values() for j in i}
+
+    grid = scaleGrid(args.scales)
+    sizes = [
+        {
+            'width': snap(images[i]['_width'], grid),
+            'height': snap(images[i]['_height'], grid),
+            'data': {
+                'name': i
+            }
+        } for i in images if i not in duplicates
+    ]
+
+    if args.pages:
+        page = createPacker(args)
+        for i in sizes:
+            if page.oversized(Rectangle(i['width'], i['height'])):
+                raise ImageError(
+                    f"Image '{i['data']['name']}' is larger than "
+                    f"{page.width}x{page.height} page"
+                )
+
+    groups: Dict[str, List[Dict]] = {}
+    for i in sizes:
+        groups.setdefault(tags[i['data']['name']], []).append(i)
+    groups = {i: groups[i] for i in sorted(groups)}
+
+    with stage(hook, 'pack'):
+        if packers is not None:
+            for tag in set(packers) - set(groups):
+                del packers[tag]
+            data = []
+            for tag, group in groups.items():
+                if tag not in packers:
+                    packers[tag] = createPacker(args, hook)
+                syncPacker(packers[tag], group)
+                data.extend(packers[tag].getData())
+            if cache:
+                cache.putLayout(sizes, data)
         else:
-            image.save(str(outFolder / f'{out}.{args.outFormat}'))
-        out += 1
+            data = cache.getLayout(sizes) if cache else None
+            if data is None:
+                packArgs = args
+                if args.optimize is not None:
+                    packArgs = optimize(args, groups, outFolder)
+                data = packGroups(packArgs, groups, hook)
+                if cache:
+                    cache.putLayout(sizes, data)
+
+    return data, aliases
+
+
+def spritesheets(
+        args: argparse.Namespace,
+        images: Dict[str, Dict],
+        store: SpriteStore,
+        cache: Optional[BuildCache] = None,
+        repNames: Dict[str, str] = None,
+        hook: Callable = None,
+        packers: Dict[str, BinPacker] = None,
+        outFolder: Path = None
+) -> List[Spritesheets]:
+    data, aliases = layout(
+        args, images, store, cache, hook, packers, outFolder
+    )
+    outFormat = args.outFormat.split(',')[0]
+    return [
+        Spritesheets(data, images, store, i, aliases, repNames, outFormat)
+        for i in args.scales
+    ]
+
+
+def writeSheets(
+        args: argparse.Namespace,
+        scaled: List[Spritesheets],
+        cache: Optional[BuildCache] = None,
+        hook: Callable = None
+) -> None:
+    # Checked before anything is written
+    largest = max((
+        sheetMemory(*i['size']) for sheets in scaled for i in sheets.data
+    ), default=1)
+    if args.max_memory and largest > args.max_memory * 2 ** 20:
+        raise ImageError(
+            f"Saving a spritesheet needs {-(-largest // 2 ** 20)} MB, "
+            f"more than --max-memory {args.max_memory} MB"
+        )
+
+    outFormats = args.outFormat.split(',')
+    exporter = getExporter(exporterName(args))
+    sheets, sheetStores, sheetPaths = [], [], []
+    for scale, current in zip(args.scales, scaled):
+        outFolder = scaleFolder(Path(args.outfolder), scale)
+        if not outFolder.exists():
+            outFolder.mkdir(parents=True)
+
+        with stage(hook, 'export'):
+            exporter(
+                current.data, current.images, outFolder, outFormats[0],
+                current.repNames, current.aliases
+            )
+
+        for out, i in enumerate(current.data):
+            paths = [outFolder / f'{out}.{j}' for j in outFormats]
+            if cache:
+                paths = [
+                    j for j in paths if cache.sheetChanged(j, i, args.profile)
+                ]
+            if paths:
+                sheets.append(i)
+                sheetStores.append(current.sprites)
+                sheetPaths.append(paths)
+
+    jobs = args.jobs
+    if args.max_memory:
+        jobs = min(jobs, max(1, args.max_memory * 2 ** 20 // largest))
+
+    with stage(hook, 'save'):
+        if jobs > 1 and len(sheets) > 1:
+            # Copying pixels, resizing and encoding release the GIL, so
+            # threads are enough
+            with ThreadPoolExecutor(min(jobs, len(sheets))) as pool:
+                list(pool.map(
+                    saveSheet, sheets, sheetStores, sheetPaths,
+                    [args.profile] * len(sheets)
+                ))
+        else:
+            for i, sprites, paths in zip(sheets, sheetStores, sheetPaths):
+                saveSheet(i, sprites, paths, args.profile)
+
+    if cache:
+        with stage(hook, 'cache'):
+            cache.save()
+
+
+
+def build(
+        args: argparse.Namespace,
+        images: Dict[str, Dict],
+        store: SpriteStore,
+        cache: Optional[BuildCache] = None,
+        repNames: Dict[str, str] = None,
+        hook: Callable = None,
+        packers: Dict[str, BinPacker] = None
+) -> None:
+    scaled = spritesheets(
+        args, images, store, cache, repNames, hook, packers,
+        Path(args.outfolder)
+    )
+    writeSheets(args, scaled, cache, hook)
+
+
+class SpriteCache:
+    # Trimmed images shared by jobs of the server, the least recently used
+    # ones are dropped past the budget. Jobs asking for an image which is
+    # being decoded wait for it instead of decoding it again.
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.used = 0
+        self.sprites: OrderedDict = OrderedDict()
+        self.pending: Dict[Tuple, Future] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, file: Path) -> Tuple[Dict, np.ndarray]:
+        stat = file.stat()
+        key = (str(file.resolve()), stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if key in self.sprites:
+                self.sprites.move_to_end(key)
+                self.hits += 1
+                return self.sprites[key]
+            future = self.pending.get(key)
+            if future is None:
+                future = self.pending[key] = Future()
+                self.misses += 1
+                decode = True
+            else:
+                decode = False
+
+        if not decode:
+            return future.result()
+
+        try:
+            result = _cleanImage(file)
+        except BaseException as e:
+            with self.lock:
+                del self.pending[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.pending[key]
+            self.put(key, result)
+        future.set_result(result)
+        return result
+
+    def put(self, key: Tuple, result: Tuple[Dict, np.ndarray]) -> None:
+        size = result[1].nbytes
+        if size > self.budget:
+            return
+        self.sprites[key] = result
+        self.used += size
+        while self.used > self.budget:
+            _, (_, pixels) = self.sprites.popitem(last=False)
+            self.used -= pixels.nbytes
+
+
+def jobPath(root: Path, cwd: Path, path: str) -> Path:
+    path = (cwd / path).resolve()
+    if not path.is_relative_to(root):
+        raise ImageError(f"Path '{path}' is outside of '{root}'")
+    return path
+
+
+def runJob(
+        job: Dict,
+        sprites: SpriteCache,
+        decoders: ThreadPoolExecutor,
+        root: Path
+) -> Dict:
+    argv = job.get('argv', [])
+    try:
+        args = argParser.parse_args(argv)
+    except SystemExit:
+        raise ImageError(f"Invalid arguments: {' '.join(argv)}") from None
+    if args.watch:
+        raise ImageError('Watch mode is not supported in pack jobs')
+    # Plugins would run any code of the client's choice in the server
+    name = exporterName(args)
+    if name not in EXPORTERS:
+        raise ImageError(f"Unknown exporter '{name}'")
+
+    # Paths are relative to the working directory of the client, the job
+    # may not touch anything outside of the root of the server
+    cwd = root / job.get('cwd', '.')
+    for key in ('dir', 'outfolder', 'cache', 'stats'):
+        if getattr(args, key):
+            setattr(args, key, str(jobPath(root, cwd, getattr(args, key))))
+    # Forking from threads of the server isn't safe, the server runs jobs
+    # side by side instead
+    args.jobs = 1
+
+    start = perf_counter()
+    home = Path(args.dir).resolve()
+    if 'files' in job:
+        files = [jobPath(root, cwd, i) for i in job['files']]
+    else:
+        files = findFiles(args, home)
+
+    stats = Stats() if args.stats else None
+    with stage(stats, 'clean'):
+        results = list(decoders.map(sprites.get, files))
+
+    cache = None
+    if args.cache:
+        cache = BuildCache(args.cache, cacheSettings(args))
+    images: Dict[str, Dict] = {}
+    store = SpriteStore()
+    for file, (data, pixels) in zip(files, results):
+        name = spriteName(file, home)
+        images[name] = dict(data)
+        store.add(name, pixels)
+        if cache:
+            cache.key(name, file)
+
+    if images:
+        build(args, images, store, cache, hook=stats)
+    if stats:
+        Path(args.stats).write_text(json.dumps(stats.toDict(), indent=4))
+    return {'images': len(images), 'time': perf_counter() - start}
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    # One JSON job per connection, answered with one JSON line
+    def handle(self) -> None:
+        server = self.server
+        try:
+            job = json.loads(self.rfile.readline())
+            reply = server.jobs.submit(
+                runJob, job, server.sprites, server.decoders, server.root
+            ).result()
+            reply['ok'] = True
+            print(f"Packed {reply['images']} images in "
+                  f"{reply['time']:.2f}s ({server.sprites.hits} cached, "
+                  f"{server.sprites.misses} decoded so far)")
+        except Exception as e:
+            reply = {'ok': False, 'error': str(e)}
+            print(f"Job failed: {e}", file=sys.stderr)
+        self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+
+class TCPJobServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class UnixJobServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve(args: argparse.Namespace) -> None:
+    if args.port:
+        address = ('127.0.0.1', args.port)
+        server = TCPJobServer(address, JobHandler)
+    else:
+        address = args.socket
+        Path(address).unlink(missing_ok=True)
+        # Only the user running the server may connect to the socket
+        umask = os.umask(0o177)
+        try:
+            server = UnixJobServer(address, JobHandler)
+        finally:
+            os.umask(umask)
+
+    server.root = Path(args.root).resolve()
+    server.sprites = SpriteCache(args.cache_size * 2 ** 20)
+    server.jobs = ThreadPoolExecutor(args.jobs)
+    server.decoders = ThreadPoolExecutor(args.jobs)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f'Listening on {address}', flush=True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.jobs.shutdown(cancel_futures=True)
+        server.decoders.shutdown(cancel_futures=True)
+        if not args.port:
+            Path(address).unlink(missing_ok=True)
+
+
+def submit(args: argparse.Namespace, argv: List[str]) -> int:
+    # Invalid arguments are reported here, just like by packer itself
+    argParser.parse_args(argv)
+
+    job = {'argv': argv, 'cwd': os.getcwd()}
+    if args.files:
+        job['files'] = [
+            i for i in Path(args.files).read_text().splitlines() if i
+        ]
+
+    if args.port:
+        address = ('127.0.0.1', args.port)
+        family = socket.AF_INET
+    else:
+        address = args.socket
+        family = socket.AF_UNIX
+
+    try:
+        with socket.socket(family, socket.SOCK_STREAM) as connection:
+            connection.connect(address)
+            connection.sendall(json.dumps(job).encode() + b'\n')
+            reply = connection.makefile('rb').readline()
+    except OSError as e:
+        submitParser.exit(1, f'Cannot reach server at {address}: {e}\n')
+    if not reply:
+        submitParser.exit(1, 'Server closed the connection\n')
+
+    reply = json.loads(reply)
+    if not reply['ok']:
+        print(reply['error'], file=sys.stderr)
+        return 1
+    print(f"Packed {reply['images']} images in {reply['time']:.2f}s")
+    return 0
+
+
+def packArgs(**options) -> argparse.Namespace:
+    # Options are named like attributes of parsed command line arguments,
+    # e.g. max_width=1024, rotate=True
+    args = argParser.parse_args([])
+    for key, value in options.items():
+        if not hasattr(args, key):
+            raise TypeError(f"Unknown option '{key}'")
+        setattr(args, key, value)
+    if isinstance(args.scales, str):
+        try:
+            args.scales = scale_list(args.scales)
+        except argparse.ArgumentTypeError as e:
+            raise ValueError(f"Option 'scales': {e}") from None
+    elif isinstance(args.scales, (list, tuple)):
+        args.scales = [Fraction(i) for i in args.scales]
+    else:
+        raise TypeError(
+            "Option 'scales' must be a list or a comma separated string"
+        )
+    return args
+
+
+def packImages(
+        args: argparse.Namespace,
+        sprites: Iterable[Tuple[str, object]],
+        store: SpriteStore,
+        repNames: Dict[str, str] = None,
+        hook: Callable = None,
+        outFolder: Path = None
+) -> List[Spritesheets]:
+    images: Dict[str, Dict] = {}
+    with stage(hook, 'clean'):
+        for name, image in sprites:
+            if name in images:
+                raise ImageError(f"Duplicate image name '{name}'")
+            try:
+                images[name], pixels = cleanSprite(image)
+            except Exception as e:
+                raise ImageError(
+                    f"Cannot process image '{name}': {e}"
+                ) from None
+            store.add(name, pixels)
+
+    return spritesheets(
+        args, images, store, repNames=repNames, hook=hook,
+        outFolder=outFolder
+    )
+
+
+def pack(
+        sprites: Iterable[Tuple[str, object]],
+        hook: Callable = None,
+        **options
+) -> List[Spritesheets]:
+    # Packs (name, PIL image or RGBA array) pairs without touching the
+    # disk, gives spritesheets of each scale in order of the scales option
+    return packImages(packArgs(**options), sprites, SpriteStore(), hook=hook)
 
 
 def run():
-    main(argParser.parse_args())
+    if sys.argv[1:2] == ['serve']:
+        serve(serveParser.parse_args(sys.argv[2:]))
+        return
+    if sys.argv[1:2] == ['submit']:
+        sys.exit(submit(*submitParser.parse_known_args(sys.argv[2:])))
+
+    args = argParser.parse_args()
+    name = exporterName(args)
+    if name not in EXPORTERS and ':' not in name:
+        argParser.error(f"unknown exporter '{name}'")
+
+    try:
+        main(args)
+    except ImageError as e:
+        argParser.exit(1, f'{e}\n')
 
 
 if __name__ == "__main__":
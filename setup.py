@@ -3,7 +3,7 @@ from setuptools import setup
 setup(
     name='Packer',
     version='1.0.0',
-    packages=['BinPacker'],
+    packages=['BinPacker', 'exporters'],
     py_modules=['packer'],
     url='',
     license='',
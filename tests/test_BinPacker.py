@@ -0,0 +1,49 @@
+from random import Random
+
+from BinPacker.BinPacker import BinPacker
+
+
+def packed(packer):
+    return {name for i in packer.getData() for name in i['rects']}
+
+
+def test_update_moves_rect_out_of_own_bin():
+    packer = BinPacker(256, 256)
+    packer.addList([
+        {'width': 200, 'height': 200, 'data': {'name': 'a'}},
+        {'width': 100, 'height': 100, 'data': {'name': 'b'}}
+    ])
+
+    packer.update('b', 120, 120)
+    assert packed(packer) == {'a', 'b'}
+    assert all(i in packer.bins for i in packer.openBins)
+
+    packer.remove('b')
+    assert packed(packer) == {'a'}
+    assert len(packer.bins) == 1
+
+
+def test_random_updates_and_removes():
+    for seed in range(50):
+        random = Random(seed)
+        packer = BinPacker(256, 256, 1)
+        names = {str(i) for i in range(60)}
+        packer.addList([
+            {
+                'width': random.randint(1, 150),
+                'height': random.randint(1, 150),
+                'data': {'name': i}
+            } for i in sorted(names)
+        ])
+
+        for _ in range(40):
+            name = random.choice(sorted(names))
+            if random.random() < 0.3:
+                packer.remove(name)
+                names.remove(name)
+            else:
+                packer.update(
+                    name, random.randint(1, 150), random.randint(1, 150)
+                )
+            assert packed(packer) == names
+            assert all(i in packer.bins for i in packer.openBins)
@@ -0,0 +1,79 @@
+from random import Random
+
+from BinPacker.FreeRects import FreeRects
+from BinPacker.ListFreeRects import FreeRects as ListFreeRects
+from BinPacker.Rectangle import Rect
+
+IMPLEMENTATIONS = [FreeRects, ListFreeRects]
+
+
+def prunePairwise(rects):
+    # Reference: every pair is checked, a rect contained in another one is
+    # dropped and of identical rects only the last one is kept
+    redundant = set()
+    for i, (x, y, w, h) in enumerate(rects):
+        for j, (jx, jy, jw, jh) in enumerate(rects):
+            if i == j:
+                continue
+            containedIn = x >= jx and y >= jy and \
+                x + w <= jx + jw and y + h <= jy + jh
+            if containedIn and ((x, y, w, h) != (jx, jy, jw, jh) or j > i):
+                redundant.add(i)
+    return [i for k, i in enumerate(rects) if k not in redundant]
+
+
+def contents(free):
+    return [(i.x, i.y, i.width, i.height) for i in free]
+
+
+def randomRects(random, count):
+    return [
+        (random.randint(0, 8), random.randint(0, 8),
+         random.randint(1, 8), random.randint(1, 8)) for _ in range(count)
+    ]
+
+
+def test_full_prune_matches_pairwise():
+    for implementation in IMPLEMENTATIONS:
+        for seed in range(100):
+            random = Random(seed)
+            rects = randomRects(random, random.randint(0, 40))
+            free = implementation()
+            for x, y, w, h in rects:
+                free.append(w, h, x, y)
+
+            free.prune()
+            assert contents(free) == prunePairwise(rects)
+
+
+def test_incremental_prune_matches_pairwise():
+    for implementation in IMPLEMENTATIONS:
+        for seed in range(100):
+            random = Random(seed)
+            free = implementation()
+            expected = []
+            for _ in range(5):
+                rects = randomRects(random, random.randint(0, 10))
+                for x, y, w, h in rects:
+                    free.append(w, h, x, y)
+
+                free.prune()
+                expected = prunePairwise(expected + rects)
+                assert contents(free) == expected
+
+
+def test_split_and_prune_matches_pairwise():
+    for implementation in IMPLEMENTATIONS:
+        for seed in range(50):
+            random = Random(seed)
+            free = implementation()
+            free.append(64, 64)
+            for _ in range(30):
+                x, y = random.randint(0, 60), random.randint(0, 60)
+                node = Rect(random.randint(1, 16), random.randint(1, 16), x, y)
+                if not free.split(node):
+                    continue
+
+                before = contents(free)
+                free.prune()
+                assert contents(free) == prunePairwise(before)